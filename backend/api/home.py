@@ -0,0 +1,14 @@
+from flask import Blueprint, current_app, request
+
+from services.home_service import home_snapshot
+
+home_bp = Blueprint('home', __name__)
+
+@home_bp.route('', methods=['GET'])
+def get_home():
+    """Portada: destacados, novedades, categorías y sucursales en una respuesta (público)"""
+    # Cuerpo ya serializado: no se consulta la base ni se construye JSON por solicitud
+    response = current_app.response_class(home_snapshot.get(), status=200, mimetype='application/json')
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
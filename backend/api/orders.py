@@ -1,16 +1,22 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime
 import uuid
 
 from app import db, sse
 from models.order import Order, OrderItem, OrderStatus, DeliveryMethod
-from models.product import Product, Stock, Branch
+from models.product import Product, Branch, MovementReason
 from models.user import User, UserRole
 from utils.auth_utils import admin_required, role_required, has_role
+from services.cache_service import catalog_cache, STOCK_VERSION, POPULARITY_VERSION
+from services.stock_service import stock_service, InsufficientStockError, RESERVATION_TTL
+from services.stock_ledger_service import stock_ledger
 
 orders_bp = Blueprint('orders', __name__)
 
+# Estados en que el pedido ya no tiene stock reservado
+CANCELLED_STATUSES = (OrderStatus.REJECTED, OrderStatus.CANCELLED)
+
 def generate_order_number():
     """Genera un número de orden único"""
     prefix = "ORD"
@@ -18,6 +24,56 @@ def generate_order_number():
     random_suffix = uuid.uuid4().hex[:6].upper()
     return f"{prefix}-{timestamp}-{random_suffix}"
 
+def publish_stock_alerts(stock_rows, products, branch):
+    """
+    Notificar por SSE los productos que quedaron sin stock
+
+    Args:
+        stock_rows: Filas (product_id, quantity, min_stock) devueltas por StockService.consume
+        products: Productos por id
+        branch: Sucursal del pedido
+    """
+    for row in stock_rows:
+        if row.quantity <= 0:
+            product = products[row.product_id]
+            sse.publish({
+                "event": "stock_alert",
+                "data": {
+                    "product_id": row.product_id,
+                    "product_name": product.name,
+                    "branch_id": branch.id,
+                    "branch_name": branch.name,
+                    "current_stock": row.quantity,
+                    "message": f"Stock bajo en {product.name} ({branch.name})"
+                }
+            }, type='stock_alert')
+
+def record_popularity(quantities):
+    """
+    Acumular la popularidad de los productos de un pedido ya confirmado
+
+    Se aplica en una transacción propia después del pedido: bloquear la
+    fila del producto dentro del pedido serializaría todos los pedidos de
+    ese producto en todas las sucursales. Si falla, el pedido se mantiene
+    y sólo se pierde el incremento (la popularidad es un criterio de orden).
+
+    Args:
+        quantities: Cantidad por product_id (ver StockService.group_lines)
+    """
+    try:
+        # Bloqueo en orden de id: dos pedidos con productos en común no se
+        # bloquean en orden inverso
+        products = Product.query.filter(Product.id.in_(quantities)) \
+            .order_by(Product.id).with_for_update(key_share=True).all()
+        for product in products:
+            product.popularity = Product.popularity + quantities[product.id]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error al actualizar la popularidad: {e}")
+        return
+    catalog_cache.bump_version(POPULARITY_VERSION)
+
 @orders_bp.route('', methods=['POST'])
 @jwt_required()
 def create_order():
@@ -79,9 +135,8 @@ def create_order():
         db.session.add(new_order)
         db.session.flush()  # Para obtener el ID de la orden
         
-        # Validar inventario y crear items de la orden
-        items_data = []
-        
+        # Validar items y agrupar cantidades por producto
+        lines = []
         for item_data in data['items']:
             product_id = item_data.get('product_id')
             quantity = item_data.get('quantity', 1)
@@ -90,23 +145,25 @@ def create_order():
                 db.session.rollback()
                 return jsonify({"error": "Datos de producto inválidos"}), 400
             
-            # Obtener producto
-            product = Product.query.get(product_id)
-            if not product:
+            lines.append((product_id, quantity))
+        
+        quantities = stock_service.group_lines(lines)
+        
+        # Obtener todos los productos en una sola consulta
+        products = {
+            product.id: product
+            for product in Product.query.filter(Product.id.in_(quantities)).all()
+        }
+        for product_id in quantities:
+            if product_id not in products:
                 db.session.rollback()
                 return jsonify({"error": f"Producto {product_id} no encontrado"}), 404
-            
-            # Verificar stock en la sucursal
-            stock = Stock.query.filter_by(
-                product_id=product_id, 
-                branch_id=data['branch_id']
-            ).first()
-            
-            if not stock or stock.quantity < quantity:
-                db.session.rollback()
-                return jsonify({
-                    "error": f"Stock insuficiente para {product.name} en la sucursal seleccionada"
-                }), 400
+        
+        # Crear items de la orden
+        items_data = []
+        
+        for product_id, quantity in lines:
+            product = products[product_id]
             
             # Calcular precio
             unit_price = product.current_price()
@@ -145,8 +202,25 @@ def create_order():
         # Actualizar monto total de la orden
         new_order.total_amount = total_amount
         new_order.discount_amount = discount_amount
+        db.session.flush()
+        
+        # Reservar el stock de todas las líneas en una sola sentencia condicional:
+        # si alguna no alcanza, no se reserva ninguna. Va al final para que los
+        # registros de stock (y las filas del listado que actualiza el
+        # trigger) queden bloqueados sólo hasta el commit. La reserva vence si
+        # el pedido no se aprueba a tiempo (ver StockService.expire_reservations)
+        try:
+            stock_service.reserve(new_order.id, data['branch_id'], quantities)
+        except InsufficientStockError as e:
+            db.session.rollback()
+            product = products[e.product_ids[0]]
+            return jsonify({
+                "error": f"Stock insuficiente para {product.name} en la sucursal seleccionada"
+            }), 400
         
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
+        record_popularity(quantities)
         
         # Respuesta
         return jsonify({
@@ -338,8 +412,8 @@ def update_order_status(order_id):
     except ValueError:
         return jsonify({"error": "Estado inválido"}), 400
     
-    # Obtener orden
-    order = Order.query.get(order_id)
+    # Obtener orden bloqueada: el barrido de reservas vencidas no la modifica a la vez
+    order = Order.query.filter_by(id=order_id).with_for_update().first()
     if not order:
         return jsonify({"error": "Pedido no encontrado"}), 404
     
@@ -365,44 +439,51 @@ def update_order_status(order_id):
         return jsonify({"error": "No autorizado para realizar este cambio de estado"}), 403
     
     try:
+        # El stock se reserva al crear el pedido, se libera si se anula
+        # y se descuenta al entregarse
+        old_status = order.status
+        stock_rows = []
+        
         # Actualizar estado
         if order.update_status(new_status, data.get('notes')):
+            quantities = stock_service.group_lines(
+                (item.product_id, item.quantity) for item in order.items
+            )
             
-            # Lógica específica según el estado
-            if new_status == OrderStatus.APPROVED:
-                # Reservar stock
-                pass
-            elif new_status == OrderStatus.REJECTED:
-                # Liberar stock si estaba reservado
-                pass
+            if new_status in CANCELLED_STATUSES:
+                # Liberar stock reservado
+                if old_status not in CANCELLED_STATUSES and old_status != OrderStatus.DELIVERED:
+                    stock_service.release(order.id, order.branch_id)
             elif new_status == OrderStatus.DELIVERED:
                 # Confirmar entrega y actualizar inventario
-                for item in order.items:
-                    # Disminuir stock
-                    stock = Stock.query.filter_by(
-                        product_id=item.product_id,
-                        branch_id=order.branch_id
-                    ).first()
-                    
-                    if stock:
-                        stock.quantity -= item.quantity
-                        
-                        # Verificar si el stock está bajo mínimo
-                        if stock.quantity <= 0:
-                            # Enviar notificación SSE
-                            sse.publish({
-                                "event": "stock_alert",
-                                "data": {
-                                    "product_id": item.product_id,
-                                    "product_name": item.product.name,
-                                    "branch_id": order.branch_id,
-                                    "branch_name": order.branch.name,
-                                    "current_stock": stock.quantity,
-                                    "message": f"Stock bajo en {item.product.name} ({order.branch.name})"
-                                }
-                            }, type='stock_alert')
+                stock_ledger.set_context(
+                    MovementReason.SALE, actor_id=get_jwt_identity(), order_id=order.id
+                )
+                try:
+                    stock_rows = stock_service.consume(order.id, order.branch_id, quantities)
+                except InsufficientStockError:
+                    db.session.rollback()
+                    return jsonify({"error": "Stock insuficiente para entregar el pedido"}), 400
+            elif old_status in CANCELLED_STATUSES:
+                # Pedido reactivado: volver a reservar su stock
+                try:
+                    stock_service.reserve(
+                        order.id, order.branch_id, quantities,
+                        ttl=RESERVATION_TTL if new_status == OrderStatus.PENDING else None
+                    )
+                except InsufficientStockError:
+                    db.session.rollback()
+                    return jsonify({"error": "Stock insuficiente para reactivar el pedido"}), 400
+            elif new_status != OrderStatus.PENDING:
+                # Pedido aprobado o en curso: la reserva deja de vencer
+                stock_service.confirm(order.id)
             
             db.session.commit()
+            catalog_cache.bump_version(STOCK_VERSION)
+            
+            if stock_rows:
+                products = {item.product_id: item.product for item in order.items}
+                publish_stock_alerts(stock_rows, products, order.branch)
             
             return jsonify({
                 "message": "Estado del pedido actualizado correctamente",
@@ -424,8 +505,9 @@ def cancel_order(order_id):
     jwt_data = get_jwt()
     role = jwt_data.get('role')
     
-    # Obtener orden
-    order = Order.query.get(order_id)
+    # Obtener orden bloqueada para que el estado no cambie (barrido de
+    # reservas, entrega) entre la validación y la liberación del stock
+    order = Order.query.filter_by(id=order_id).with_for_update().first()
     if not order:
         return jsonify({"error": "Pedido no encontrado"}), 404
     
@@ -444,7 +526,11 @@ def cancel_order(order_id):
         notes = request.json.get('notes', 'Cancelado por el usuario')
         order.update_status(OrderStatus.CANCELLED, notes)
         
+        # Liberar stock reservado
+        stock_service.release(order.id, order.branch_id)
+        
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
         
         return jsonify({
             "message": "Pedido cancelado correctamente",
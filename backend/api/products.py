@@ -1,74 +1,295 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import json
-from sqlalchemy import or_
+import csv
+import io
+from datetime import datetime
+from sqlalchemy import and_, exists, func, literal_column, select, update, insert, cast, literal, Numeric
+from sqlalchemy.orm import joinedload
+from werkzeug.datastructures import MultiDict
 
 from app import db
-from models.product import Product, ProductCategory, Stock, Branch, PriceHistory
+from models.product import Product, ProductCategory, Stock, Branch, PriceHistory, ProductChange, ProductListing, MovementReason
 from utils.auth_utils import admin_required, role_required, has_role
+from utils.search_utils import apply_product_search, SEARCH_AUTO
+from utils.pagination import paginate_keyset, order_by_keys, keyset_filter, encode_cursor, decode_cursor, count_query, COUNT_MODES, COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE
 from models.user import UserRole
+from services.cache_service import catalog_cache, STOCK_VERSION, POPULARITY_VERSION
+from services.import_service import ProductImportService
+from services.suggest_service import suggestion_index
+from services.stock_ledger_service import stock_ledger
+from utils.http_utils import conditional_response
+from utils.json_utils import dumps, rows_to_dicts
 
 products_bp = Blueprint('products', __name__)
 
-# Rutas públicas
-@products_bp.route('', methods=['GET'])
-def get_products():
-    """Obtener lista de productos (público)"""
-    # Parámetros de paginación y filtrado
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 12, type=int)
-    category = request.args.get('category')
-    subcategory = request.args.get('subcategory')
-    brand = request.args.get('brand')
-    search = request.args.get('search')
-    featured = request.args.get('featured', type=bool)
-    new = request.args.get('new', type=bool)
-    min_price = request.args.get('min_price', type=float)
-    max_price = request.args.get('max_price', type=float)
+# Ordenamientos del catálogo: clave de orden total (expresión, descendente),
+# cada una respaldada por un índice compuesto del modelo de lectura
+# (ver db/schemas.py:add_product_listing)
+PRODUCT_SORTS = {
+    'price': [(ProductListing.price, False), (ProductListing.id, False)],
+    '-price': [(ProductListing.price, True), (ProductListing.id, True)],
+    'newest': [(ProductListing.created_at, True), (ProductListing.id, True)],
+    'name': [(ProductListing.name, False), (ProductListing.id, False)],
+    'popularity': [(ProductListing.popularity, True), (ProductListing.id, True)]
+}
+
+# Vigencia más corta para el detalle, que incluye cantidades de stock por sucursal
+PRODUCT_DETAIL_CACHE_TTL = 15
+
+# Registros de historial de precios devueltos en el detalle de producto
+DEFAULT_HISTORY_LIMIT = 30
+MAX_HISTORY_LIMIT = 365
+
+# Cambios entregados por página en el feed de la API externa
+DEFAULT_CHANGES_LIMIT = 500
+MAX_CHANGES_LIMIT = 1000
+
+# Filas leídas por consulta al exportar el catálogo
+EXPORT_BATCH_SIZE = 1000
+
+# Columnas del catálogo exportado
+EXPORT_FIELDS = [
+    'id', 'sku', 'name', 'description', 'brand', 'brand_code', 'category',
+    'subcategory', 'price', 'current_price', 'discount_percentage',
+    'is_featured', 'is_new', 'image_url', 'created_at', 'updated_at'
+]
+
+# Sugerencias devueltas por el autocompletado
+DEFAULT_SUGGEST_LIMIT = 8
+MAX_SUGGEST_LIMIT = 20
+
+# Productos solicitados como máximo en una consulta por lote
+MAX_BATCH_IDS = 500
+
+# Límites de los rangos de precio (CLP) para las facetas del catálogo
+PRICE_BUCKETS = [0, 10000, 25000, 50000, 100000, 250000]
+
+# Barras del histograma de precios
+DEFAULT_HISTOGRAM_BUCKETS = 10
+MAX_HISTOGRAM_BUCKETS = 50
+
+# Parámetros de filtrado del catálogo (compartidos por listado y facetas)
+PRODUCT_FILTER_PARAMS = (
+    'category', 'subcategory', 'brand', 'search', 'fuzzy',
+    'featured', 'new', 'min_price', 'max_price', 'branch_id', 'in_stock'
+)
+
+# Parámetros del histograma de precios y de la lista de marcas
+CATEGORY_FILTER_PARAMS = ('category', 'subcategory')
+
+def apply_product_filters(query, args):
+    """
+    Aplica los filtros del catálogo a una consulta del modelo de lectura
     
-    # Iniciar consulta
-    query = Product.query
+    Args:
+        query: Consulta SQLAlchemy sobre ProductListing
+        args: Parámetros de la solicitud (request.args)
+        
+    Returns:
+        tuple: (consulta filtrada, expresión de relevancia o None)
+    """
+    category = args.get('category')
+    subcategory = args.get('subcategory')
+    brand = args.get('brand')
+    search = args.get('search')
+    fuzzy = args.get('fuzzy', SEARCH_AUTO)
+    featured = args.get('featured', type=bool)
+    new = args.get('new', type=bool)
+    min_price = args.get('min_price', type=float)
+    max_price = args.get('max_price', type=float)
+    branch_id = args.get('branch_id', type=int)
+    in_stock = args.get('in_stock', '').lower() == 'true'
     
-    # Aplicar filtros
     if category:
         try:
-            query = query.filter_by(category=ProductCategory(category))
+            query = query.filter(ProductListing.category == ProductCategory(category))
         except ValueError:
             pass
     
     if subcategory:
-        query = query.filter_by(subcategory=subcategory)
+        query = query.filter(ProductListing.subcategory == subcategory)
     
     if brand:
-        query = query.filter_by(brand=brand)
-    
-    if search:
-        query = query.filter(
-            or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.description.ilike(f'%{search}%'),
-                Product.brand.ilike(f'%{search}%'),
-                Product.sku.ilike(f'%{search}%')
-            )
-        )
+        query = query.filter(ProductListing.brand == brand)
     
     if featured is not None:
-        query = query.filter_by(is_featured=featured)
+        query = query.filter(ProductListing.is_featured == featured)
     
     if new is not None:
-        query = query.filter_by(is_new=new)
+        query = query.filter(ProductListing.is_new == new)
     
     if min_price is not None:
-        query = query.filter(Product.price >= min_price)
+        query = query.filter(ProductListing.price >= min_price)
     
     if max_price is not None:
-        query = query.filter(Product.price <= max_price)
+        query = query.filter(ProductListing.price <= max_price)
+    
+    if in_stock and branch_id is not None:
+        # Sucursales con stock ya agregadas en la fila (índice GIN)
+        query = query.filter(ProductListing.available_branches.contains([branch_id]))
+    elif in_stock:
+        query = query.filter(ProductListing.total_stock > 0)
+    elif branch_id is not None:
+        # Productos con registro de stock en la sucursal, aunque esté agotado
+        query = query.filter(exists().where(and_(
+            Stock.product_id == ProductListing.id,
+            Stock.branch_id == branch_id
+        )))
+    
+    # La búsqueda va al final: en modo automático verifica si hay
+    # coincidencias exactas con el resto de los filtros ya aplicados
+    rank = None
+    if search:
+        query, rank = apply_product_search(query, ProductListing, search, fuzzy)
+    
+    return query, rank
+
+
+def catalog_etag(*args, **kwargs):
+    """Validador de ETag para lecturas que sólo dependen de la versión del catálogo"""
+    return catalog_cache.get_version()
+
+
+def stock_filter_watermark(*args, **kwargs):
+    """
+    Versión del stock cuando el listado filtra por disponibilidad
+
+    El stock cambia sin incrementar la versión del catálogo, por lo que
+    los listados filtrados por sucursal o disponibilidad incluyen el
+    contador de stock (incrementado después de cada escritura confirmada)
+    en su ETag y en su clave de caché.
+    """
+    if 'branch_id' not in request.args and 'in_stock' not in request.args:
+        return ''
+    return catalog_cache.get_version(STOCK_VERSION)
+
+
+def listing_watermark(*args, **kwargs):
+    """
+    Contadores del listado además de la versión del catálogo: el stock si
+    filtra por disponibilidad y la popularidad si se ordena por ella (cada
+    pedido la incrementa sin cambiar la versión del catálogo)
+    """
+    stock_version = stock_filter_watermark()
+    if request.args.get('sort') != 'popularity':
+        return stock_version
+    popularity_version = catalog_cache.get_version(POPULARITY_VERSION)
+    if stock_version is None or popularity_version is None:
+        return None
+    return f"{stock_version}:{popularity_version}"
+
+
+def catalog_listing_etag(*args, **kwargs):
+    """Validador de ETag del listado: versión del catálogo y, si corresponde, stock y popularidad"""
+    version, watermark = catalog_cache.get_version(), listing_watermark()
+    if version is None or watermark is None:
+        return None
+    return f"{version}:{watermark}"
+
+
+def product_detail_etag(product_id):
+    """
+    Validador de ETag y de caché del detalle: versión del catálogo y último
+    cambio de stock del producto (el cuerpo cacheado y el ETag salen del
+    mismo estado)
+
+    ETag y caché lo piden en la misma solicitud: se calcula una sola vez.
+    """
+    computed = g.get('product_detail_etag')
+    if computed is not None and computed[0] == product_id:
+        return computed[1]
+
+    version = catalog_cache.get_version()
+    token = None
+    if version is not None:
+        last_update, stock_count = db.session.query(
+            func.max(Stock.updated_at), func.count(Stock.id)
+        ).filter(Stock.product_id == product_id).one()
+        token = f"{version}:{last_update}:{stock_count}"
+
+    g.product_detail_etag = (product_id, token)
+    return token
+
+
+# Rutas públicas
+@products_bp.route('', methods=['GET'])
+@conditional_response(catalog_listing_etag)
+@catalog_cache.cached('products', validator=listing_watermark)
+def get_products():
+    """Obtener lista de productos (público)"""
+    # Parámetros de paginación y orden
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 12, type=int)
+    sort = request.args.get('sort')
+    
+    # Paginación por cursor: basta con enviar el parámetro (vacío en la primera página)
+    cursor = request.args.get('cursor')
+    count_mode = request.args.get('count', COUNT_EXACT if cursor is None else COUNT_NONE)
+    if count_mode not in COUNT_MODES:
+        return jsonify({"error": "Modo de conteo inválido"}), 400
+    
+    if sort and sort not in PRODUCT_SORTS:
+        return jsonify({"error": "Ordenamiento inválido"}), 400
+    
+    # Aplicar filtros sobre el modelo de lectura (precio, stock y búsqueda en una fila);
+    # se consultan sólo columnas para serializar las filas sin construir objetos del ORM
+    columns = ProductListing.list_columns()
+    query, rank = apply_product_filters(db.session.query(*columns), request.args)
+    
+    # Clave de orden total: la solicitada, o relevancia cuando hay búsqueda,
+    # siempre con el id como desempate
+    if sort:
+        sort_keys = PRODUCT_SORTS[sort]
+    elif rank is not None:
+        sort, sort_keys = 'relevance', [(rank, True), (ProductListing.id, False)]
+    else:
+        sort, sort_keys = 'id', [(ProductListing.id, False)]
+    
+    if cursor is not None:
+        # Paginación por cursor: costo proporcional al tamaño de página
+        total = count_query(query, count_mode)
+        try:
+            items, next_cursor = paginate_keyset(query, sort_keys, cursor, per_page, key=sort)
+        except ValueError:
+            return jsonify({"error": "Cursor inválido"}), 400
+        
+        return jsonify({
+            "products": rows_to_dicts(items, columns),
+            "pagination": {
+                "total": total,
+                "total_is_estimate": count_mode == COUNT_ESTIMATE,
+                "per_page": per_page,
+                "next_cursor": next_cursor,
+                "has_next": next_cursor is not None
+            }
+        }), 200
+    
+    query = order_by_keys(query, sort_keys)
+    
+    if count_mode != COUNT_EXACT:
+        # Paginación por página sin COUNT(*): se pide una fila extra para saber si hay más
+        total = count_query(query, count_mode)
+        items = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+        has_next = len(items) > per_page
+        
+        return jsonify({
+            "products": rows_to_dicts(items[:per_page], columns),
+            "pagination": {
+                "total": total,
+                "total_is_estimate": count_mode == COUNT_ESTIMATE,
+                "pages": None,
+                "page": page,
+                "per_page": per_page,
+                "has_next": has_next,
+                "has_prev": page > 1
+            }
+        }), 200
     
     # Ejecutar consulta paginada
     pagination = query.paginate(page=page, per_page=per_page)
     
     # Preparar respuesta
-    products = [product.to_dict() for product in pagination.items]
+    products = rows_to_dicts(pagination.items, columns)
     
     return jsonify({
         "products": products,
@@ -83,10 +304,269 @@ def get_products():
     }), 200
 
 
+@products_bp.route('/facets', methods=['GET'])
+@catalog_cache.cached('facets', include=PRODUCT_FILTER_PARAMS, validator=stock_filter_watermark)
+def get_product_facets():
+    """Obtener conteos por categoría, marca, subcategoría y rango de precio (público)"""
+    # Todas las facetas se calculan en una sola pasada con GROUPING SETS
+    thresholds = ', '.join(str(limit) for limit in PRICE_BUCKETS)
+    bucket = func.width_bucket(ProductListing.price, literal_column(f"ARRAY[{thresholds}]::numeric[]"))
+    
+    query = db.session.query(
+        ProductListing.category,
+        ProductListing.brand,
+        ProductListing.subcategory,
+        bucket.label('price_bucket'),
+        func.grouping(ProductListing.category).label('by_category'),
+        func.grouping(ProductListing.brand).label('by_brand'),
+        func.grouping(ProductListing.subcategory).label('by_subcategory'),
+        func.count().label('count')
+    )
+    query, _ = apply_product_filters(query, request.args)
+    rows = query.group_by(
+        func.grouping_sets(ProductListing.category, ProductListing.brand, ProductListing.subcategory, bucket)
+    ).all()
+    
+    facets = {
+        "categories": [],
+        "brands": [],
+        "subcategories": [],
+        "price_ranges": []
+    }
+    
+    # grouping() vale 0 para la columna por la que se agrupó la fila
+    for row in rows:
+        if row.by_category == 0:
+            facets["categories"].append({
+                "id": row.category.value,
+                "name": row.category.value,
+                "count": row.count
+            })
+        elif row.by_brand == 0:
+            if row.brand:
+                facets["brands"].append({"name": row.brand, "count": row.count})
+        elif row.by_subcategory == 0:
+            if row.subcategory:
+                facets["subcategories"].append({"name": row.subcategory, "count": row.count})
+        elif row.price_bucket:
+            index = row.price_bucket
+            facets["price_ranges"].append({
+                "min": PRICE_BUCKETS[index - 1],
+                "max": PRICE_BUCKETS[index] if index < len(PRICE_BUCKETS) else None,
+                "count": row.count
+            })
+    
+    for values in facets.values():
+        values.sort(key=lambda facet: -facet["count"])
+    facets["price_ranges"].sort(key=lambda facet: facet["min"])
+    
+    return jsonify({"facets": facets}), 200
+
+
+def filter_by_category(query, args):
+    """
+    Aplica sólo los filtros de categoría y subcategoría del catálogo
+
+    Usa apply_product_filters, por lo que una categoría desconocida se
+    ignora igual que en el listado.
+
+    Returns:
+        Consulta filtrada
+    """
+    query, _ = apply_product_filters(query, MultiDict(
+        [(key, value) for key, value in args.items(multi=True) if key in CATEGORY_FILTER_PARAMS]
+    ))
+    return query
+
+
+@products_bp.route('/price-histogram', methods=['GET'])
+@catalog_cache.cached('price_histogram', include=CATEGORY_FILTER_PARAMS + ('buckets',))
+def get_price_histogram():
+    """Precio mínimo, máximo e histograma de precios de una categoría (público)"""
+    buckets = max(min(request.args.get('buckets', DEFAULT_HISTOGRAM_BUCKETS, type=int), MAX_HISTOGRAM_BUCKETS), 1)
+    
+    # Extremos: dos lecturas del índice (category, price, id)
+    min_price, max_price = filter_by_category(
+        db.session.query(func.min(ProductListing.price), func.max(ProductListing.price)),
+        request.args
+    ).one()
+    if min_price is None:
+        return jsonify({"min_price": None, "max_price": None, "histogram": []}), 200
+    
+    if min_price == max_price:
+        count = filter_by_category(db.session.query(func.count(ProductListing.id)), request.args).scalar()
+        histogram = [{"min": float(min_price), "max": float(max_price), "count": count}]
+    else:
+        # El precio máximo cae fuera del último rango de width_bucket: se incluye en él
+        width = (max_price - min_price) / buckets
+        bucket = func.least(func.width_bucket(ProductListing.price, min_price, max_price, buckets), buckets)
+        rows = filter_by_category(
+            db.session.query(bucket.label('bucket'), func.count().label('count')),
+            request.args
+        ).group_by(bucket).all()
+        counts = {row.bucket: row.count for row in rows}
+        
+        histogram = [
+            {
+                "min": float(min_price + width * (index - 1)),
+                "max": float(min_price + width * index) if index < buckets else float(max_price),
+                "count": counts.get(index, 0)
+            } for index in range(1, buckets + 1)
+        ]
+    
+    return jsonify({
+        "min_price": float(min_price),
+        "max_price": float(max_price),
+        "histogram": histogram
+    }), 200
+
+
+@products_bp.route('/brands', methods=['GET'])
+@catalog_cache.cached('brands', include=CATEGORY_FILTER_PARAMS)
+def get_brands():
+    """Marcas distintas de una categoría con su cantidad de productos (público)"""
+    query = filter_by_category(
+        db.session.query(ProductListing.brand, func.count().label('count')),
+        request.args
+    )
+    rows = query.filter(ProductListing.brand.isnot(None)).group_by(
+        ProductListing.brand
+    ).order_by(ProductListing.brand).all()
+    
+    return jsonify({"brands": [{"name": row.brand, "count": row.count} for row in rows]}), 200
+
+
+@products_bp.route('/suggest', methods=['GET'])
+def suggest_products():
+    """Autocompletado de productos por nombre, marca o SKU (público)"""
+    q = request.args.get('q', '')
+    limit = min(request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int), MAX_SUGGEST_LIMIT)
+    
+    if not q.strip():
+        return jsonify({"suggestions": []}), 200
+    
+    # Índice en memoria del worker (vacío hasta que el hilo termina de construirlo)
+    return jsonify({"suggestions": suggestion_index.suggest(q, limit)}), 200
+
+
+@products_bp.before_app_request
+def start_suggestion_index():
+    """Iniciar con el worker el hilo del índice de sugerencias"""
+    suggestion_index.start(current_app._get_current_object())
+
+
+def parse_batch_ids(raw_ids):
+    """
+    Normaliza la lista de ids de una consulta por lote
+
+    Args:
+        raw_ids: Lista de ids o texto separado por comas
+
+    Returns:
+        list: Ids únicos en el orden recibido
+
+    Raises:
+        ValueError: Si algún id no es un entero o se excede MAX_BATCH_IDS
+    """
+    if isinstance(raw_ids, str):
+        raw_ids = [value for value in raw_ids.split(',') if value.strip()]
+    if not isinstance(raw_ids, list):
+        raise ValueError("ids debe ser una lista")
+
+    product_ids = []
+    for value in raw_ids:
+        if isinstance(value, bool):
+            raise ValueError(f"Id inválido: {value}")
+        try:
+            product_id = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Id inválido: {value}")
+        if product_id not in product_ids:
+            product_ids.append(product_id)
+
+    if len(product_ids) > MAX_BATCH_IDS:
+        raise ValueError(f"Máximo {MAX_BATCH_IDS} productos por consulta")
+    return product_ids
+
+
+@products_bp.route('/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    """
+    Obtener varios productos por id en una sola consulta (público)
+
+    GET /batch?ids=1,2,3 o POST /batch con {"ids": [...]} para listas largas.
+    Con include_stock se agrega la disponibilidad por sucursal (opcionalmente
+    sólo la de branch_id).
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Se espera un objeto con la lista de ids"}), 400
+        raw_ids = data.get('ids', [])
+        include_stock = bool(data.get('include_stock', False))
+        branch_id = data.get('branch_id')
+    else:
+        raw_ids = request.args.get('ids', '')
+        include_stock = request.args.get('include_stock', 'false').lower() == 'true'
+        branch_id = request.args.get('branch_id', type=int)
+
+    try:
+        product_ids = parse_batch_ids(raw_ids)
+        if branch_id is not None:
+            branch_id = int(branch_id)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not product_ids:
+        return jsonify({"products": {}, "missing": []}), 200
+
+    # Todos los productos en una sola consulta IN
+    products = Product.query.filter(Product.id.in_(product_ids)).all()
+    result = {product.id: product.to_dict() for product in products}
+
+    if include_stock:
+        for product_data in result.values():
+            product_data["stocks"] = []
+
+        # Disponibilidad de todos los productos en una segunda consulta
+        stock_query = db.session.query(
+            Stock.product_id, Stock.branch_id, Branch.name, Stock.quantity, Stock.reserved
+        ).join(Branch, Branch.id == Stock.branch_id).filter(
+            Stock.product_id.in_(result.keys())
+        )
+        if branch_id is not None:
+            stock_query = stock_query.filter(Stock.branch_id == branch_id)
+
+        for product_id, stock_branch_id, branch_name, quantity, reserved in stock_query.order_by(
+            Stock.product_id, Stock.branch_id
+        ):
+            result[product_id]["stocks"].append({
+                "branch_id": stock_branch_id,
+                "branch_name": branch_name,
+                "quantity": quantity,
+                "available": quantity - reserved,
+                "is_available": quantity - reserved > 0
+            })
+
+    return jsonify({
+        "products": {str(product_id): data for product_id, data in result.items()},
+        "missing": [product_id for product_id in product_ids if product_id not in result]
+    }), 200
+
+
 @products_bp.route('/<int:product_id>', methods=['GET'])
+@conditional_response(product_detail_etag)
+@catalog_cache.cached('product', ttl=PRODUCT_DETAIL_CACHE_TTL, validator=product_detail_etag)
 def get_product(product_id):
     """Obtener detalles de un producto (público)"""
-    product = Product.query.get(product_id)
+    # Parámetros del historial de precios
+    history_limit = min(request.args.get('history_limit', DEFAULT_HISTORY_LIMIT, type=int), MAX_HISTORY_LIMIT)
+    history_from = request.args.get('history_from')
+    
+    # Producto con su stock y sucursales en una sola consulta
+    product = Product.query.options(
+        joinedload(Product.stocks).joinedload(Stock.branch)
+    ).get(product_id)
     if not product:
         return jsonify({"error": "Producto no encontrado"}), 404
     
@@ -94,19 +574,33 @@ def get_product(product_id):
     
     # Agregar información de stock por sucursal
     stocks_by_branch = []
-    for stock in product.stocks:
+    for stock in sorted(product.stocks, key=lambda s: s.branch_id):
         stocks_by_branch.append({
             "branch_id": stock.branch_id,
             "branch_name": stock.branch.name,
             "quantity": stock.quantity,
-            "is_available": stock.quantity > 0
+            "available": stock.available(),
+            "is_available": stock.available() > 0
         })
     
     product_data["stocks"] = stocks_by_branch
     
-    # Historial de precios
+    # Historial de precios: los últimos registros del rango solicitado
+    history_query = PriceHistory.query.filter(PriceHistory.product_id == product_id)
+    
+    if history_from:
+        try:
+            from_datetime = datetime.fromisoformat(history_from.replace('Z', '+00:00'))
+            history_query = history_query.filter(PriceHistory.created_at >= from_datetime)
+        except (ValueError, TypeError):
+            return jsonify({"error": "Fecha de historial inválida"}), 400
+    
+    history_records = history_query.order_by(
+        PriceHistory.created_at.desc(), PriceHistory.id.desc()
+    ).limit(max(history_limit, 0)).all()
+    
     price_history = []
-    for price_record in product.price_history:
+    for price_record in reversed(history_records):
         price_history.append({
             "date": price_record.created_at.isoformat(),
             "price": float(price_record.price)
@@ -118,6 +612,7 @@ def get_product(product_id):
 
 
 @products_bp.route('/categories', methods=['GET'])
+@catalog_cache.cached('categories')
 def get_categories():
     """Obtener lista de categorías (público)"""
     categories = [{"id": cat.value, "name": cat.value} for cat in ProductCategory]
@@ -125,6 +620,8 @@ def get_categories():
 
 
 @products_bp.route('/branches', methods=['GET'])
+@conditional_response(catalog_etag)
+@catalog_cache.cached('branches')
 def get_branches():
     """Obtener lista de sucursales (público)"""
     branches = Branch.query.all()
@@ -139,7 +636,8 @@ def get_product_api(sku):
     if not product:
         return jsonify({"error": "Producto no encontrado"}), 404
     
-    return jsonify(product.to_api_dict()), 200
+    prices = PriceHistory.latest_for_products([product.id])
+    return jsonify(product.to_api_dict(prices[product.id])), 200
 
 
 @products_bp.route('/api/products', methods=['GET'])
@@ -149,8 +647,8 @@ def get_products_api():
     brand = request.args.get('brand')
     category = request.args.get('category')
     
-    # Iniciar consulta
-    query = Product.query
+    # Iniciar consulta sobre el modelo de lectura
+    query = ProductListing.query
     
     # Aplicar filtros
     if brand:
@@ -165,7 +663,75 @@ def get_products_api():
     # Limitar a 100 resultados para evitar sobrecarga
     products = query.limit(100).all()
     
-    return jsonify([product.to_api_dict() for product in products]), 200
+    # Últimos precios de todos los productos en una sola consulta
+    prices = PriceHistory.latest_for_products([product.id for product in products])
+    
+    return jsonify([product.to_api_dict(prices[product.id]) for product in products]), 200
+
+
+@products_bp.route('/changes', methods=['GET'])
+def get_product_changes_api():
+    """API pública de cambios incrementales de productos y precios"""
+    since = request.args.get('since')
+    limit = max(min(request.args.get('limit', DEFAULT_CHANGES_LIMIT, type=int), MAX_CHANGES_LIMIT), 1)
+    
+    # Sólo se entregan cambios de transacciones anteriores a la más antigua
+    # aún en curso: así un cambio confirmado tarde nunca queda detrás del cursor
+    xmin = db.session.query(func.txid_snapshot_xmin(func.txid_current_snapshot())).scalar()
+    
+    sort_keys = [(ProductChange.txid, False), (ProductChange.id, False)]
+    query = ProductChange.query.filter(ProductChange.txid < xmin)
+    
+    if since:
+        try:
+            query = query.filter(keyset_filter(sort_keys, decode_cursor(since)))
+        except ValueError:
+            return jsonify({"error": "Cursor inválido"}), 400
+    
+    changes = order_by_keys(query, sort_keys).limit(limit + 1).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    
+    # Consolidar: último estado por producto y bajas por SKU
+    upserted = {}
+    deleted = []
+    price_ids = []
+    
+    for change in changes:
+        if change.entity == 'price':
+            price_ids.append(change.price_history_id)
+        elif change.operation == 'delete':
+            upserted.pop(change.product_id, None)
+            deleted.append(change.sku)
+        else:
+            upserted[change.product_id] = change.sku
+    
+    # Productos vigentes y sus últimos precios en consultas por lote
+    products = Product.query.filter(Product.id.in_(list(upserted))).all() if upserted else []
+    prices = PriceHistory.latest_for_products([product.id for product in products])
+    
+    price_changes = []
+    if price_ids:
+        price_rows = db.session.query(PriceHistory, Product.sku).join(
+            Product, PriceHistory.product_id == Product.id
+        ).filter(PriceHistory.id.in_(price_ids)).order_by(PriceHistory.id).all()
+        
+        for price_record, sku in price_rows:
+            price_changes.append({
+                'Código del producto': sku,
+                'Fecha': price_record.created_at.isoformat(),
+                'Valor': float(price_record.price)
+            })
+    
+    next_cursor = encode_cursor([changes[-1].txid, changes[-1].id]) if changes else since
+    
+    return jsonify({
+        "products": [product.to_api_dict(prices[product.id]) for product in products],
+        "price_changes": price_changes,
+        "deleted": list(dict.fromkeys(deleted)),
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }), 200
 
 
 # Rutas administrativas
@@ -219,6 +785,7 @@ def create_product():
         
         # Inicializar stock en sucursales si se proporciona
         if 'stocks' in data and isinstance(data['stocks'], list):
+            stock_ledger.set_context(MovementReason.INITIAL, actor_id=get_jwt_identity())
             for stock_data in data['stocks']:
                 if 'branch_id' in stock_data and 'quantity' in stock_data:
                     stock = Stock(
@@ -230,6 +797,7 @@ def create_product():
                     db.session.add(stock)
         
         db.session.commit()
+        catalog_cache.bump_version()
         
         return jsonify({
             "message": "Producto creado exitosamente",
@@ -290,6 +858,7 @@ def update_product(product_id):
                 setattr(product, field, data[field])
         
         db.session.commit()
+        catalog_cache.bump_version()
         
         return jsonify({
             "message": "Producto actualizado correctamente",
@@ -313,12 +882,238 @@ def delete_product(product_id):
     try:
         db.session.delete(product)
         db.session.commit()
+        catalog_cache.bump_version()
         return jsonify({"message": "Producto eliminado correctamente"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
 
+@products_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_cache_stats():
+    """Obtener métricas de la caché del catálogo en este worker (solo admin)"""
+    return jsonify({"cache": catalog_cache.get_stats()}), 200
+
+
+@products_bp.route('/import', methods=['POST'])
+@jwt_required()
+@admin_required
+def import_products():
+    """Importar productos en lote desde CSV o NDJSON (solo admin)"""
+    upload = request.files.get('file')
+    file_format = request.args.get('format')
+    
+    if upload:
+        stream = upload.stream
+        if not file_format and upload.filename:
+            file_format = 'ndjson' if upload.filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+    else:
+        stream = request.stream
+    
+    file_format = file_format or 'csv'
+    if file_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Formato inválido"}), 400
+    
+    summary = ProductImportService().import_stream(stream, file_format)
+    if summary['inserted'] or summary['updated']:
+        catalog_cache.bump_version()
+    
+    return jsonify({
+        "message": "Importación de productos completada",
+        "summary": summary
+    }), 200
+
+
+@products_bp.route('/bulk-price', methods=['POST'])
+@jwt_required()
+@admin_required
+def bulk_update_prices():
+    """Actualización masiva de precios por filtro (solo admin)"""
+    data = request.json or {}
+    filters = data.get('filter') or {}
+    rule = data.get('rule') or {}
+    
+    # Filtro de productos: categoría, marca y/o lista de SKU
+    conditions = []
+    
+    if filters.get('category'):
+        try:
+            conditions.append(Product.category == ProductCategory(filters['category']))
+        except ValueError:
+            return jsonify({"error": "Categoría inválida"}), 400
+    
+    if filters.get('brand'):
+        conditions.append(Product.brand == filters['brand'])
+    
+    if filters.get('skus'):
+        if not isinstance(filters['skus'], list):
+            return jsonify({"error": "Se espera una lista de SKU"}), 400
+        conditions.append(Product.sku.in_(filters['skus']))
+    
+    if not conditions and not filters.get('all'):
+        return jsonify({"error": "Se requiere un filtro (o all=true para todo el catálogo)"}), 400
+    
+    # Regla de precio
+    rule_type = rule.get('type')
+    try:
+        value = float(rule['value'])
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": "Valor de la regla inválido"}), 400
+    
+    now = func.timezone('utc', func.now())
+    
+    try:
+        if rule_type == 'discount_percentage':
+            if not 0 <= value <= 100:
+                return jsonify({"error": "El descuento debe estar entre 0 y 100"}), 400
+            
+            # El descuento no cambia el precio de lista: no genera historial
+            result = db.session.execute(
+                update(Product).where(*conditions).values(
+                    discount_percentage=int(value), updated_at=now
+                ).execution_options(synchronize_session=False)
+            )
+            updated_count = result.rowcount
+            history_count = 0
+        else:
+            if rule_type == 'absolute':
+                if value <= 0:
+                    return jsonify({"error": "El precio debe ser mayor a cero"}), 400
+                new_price = cast(literal(value), Numeric(10, 2))
+            elif rule_type == 'percent':
+                if value <= -100:
+                    return jsonify({"error": "El porcentaje debe ser mayor a -100"}), 400
+                # Decimales del precio resultante (0 por defecto: pesos chilenos)
+                try:
+                    decimals = int(rule.get('round', 0))
+                except (ValueError, TypeError):
+                    return jsonify({"error": "Redondeo inválido"}), 400
+                new_price = func.round(Product.price * (1 + value / 100), decimals)
+            else:
+                return jsonify({"error": "Tipo de regla inválido"}), 400
+            
+            # Un solo UPDATE ... RETURNING alimenta el INSERT del historial
+            updated = update(Product).where(
+                *conditions, Product.price != new_price
+            ).values(
+                price=new_price, updated_at=now
+            ).returning(Product.id, Product.price).cte('updated')
+            
+            history = insert(PriceHistory).from_select(
+                ['product_id', 'price', 'created_at'],
+                select(updated.c.id, updated.c.price, now)
+            ).returning(PriceHistory.id).cte('history')
+            
+            history_count = db.session.execute(
+                select(func.count()).select_from(history)
+            ).scalar()
+            updated_count = history_count
+        
+        db.session.commit()
+        catalog_cache.bump_version()
+        
+        return jsonify({
+            "message": "Actualización masiva de precios completada",
+            "updated": updated_count,
+            "price_history_records": history_count
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+def iter_catalog_rows():
+    """
+    Recorre todo el catálogo en lotes por id, sin hidratar objetos ORM
+    
+    Cada lote es una consulta corta por rango de id; la sesión se cierra
+    entre lotes para no mantener una transacción abierta durante la
+    exportación y la memoria usada no depende del tamaño del catálogo.
+    
+    Yields:
+        dict: Fila del producto con las columnas de EXPORT_FIELDS
+    """
+    columns = [
+        Product.id, Product.sku, Product.name, Product.description, Product.brand,
+        Product.brand_code, Product.category, Product.subcategory, Product.price,
+        Product.discount_percentage, Product.is_featured, Product.is_new,
+        Product.image_url, Product.created_at, Product.updated_at
+    ]
+    last_id = 0
+    
+    while True:
+        rows = db.session.query(*columns).filter(
+            Product.id > last_id
+        ).order_by(Product.id).limit(EXPORT_BATCH_SIZE).all()
+        db.session.close()
+        
+        if not rows:
+            return
+        
+        for row in rows:
+            yield {
+                'id': row.id,
+                'sku': row.sku,
+                'name': row.name,
+                'description': row.description,
+                'brand': row.brand,
+                'brand_code': row.brand_code,
+                'category': row.category.value,
+                'subcategory': row.subcategory,
+                'price': float(row.price),
+                'current_price': Product.compute_price(row.price, row.discount_percentage),
+                'discount_percentage': row.discount_percentage,
+                'is_featured': row.is_featured,
+                'is_new': row.is_new,
+                'image_url': row.image_url,
+                'created_at': row.created_at.isoformat() if row.created_at else None,
+                'updated_at': row.updated_at.isoformat() if row.updated_at else None
+            }
+        
+        last_id = rows[-1].id
+
+
+@products_bp.route('/export', methods=['GET'])
+@jwt_required()
+@admin_required
+def export_products():
+    """Exportar el catálogo completo en NDJSON o CSV (solo admin)"""
+    export_format = request.args.get('format', 'ndjson')
+    
+    if export_format == 'ndjson':
+        def generate():
+            for row in iter_catalog_rows():
+                yield dumps(row) + b'\n'
+        
+        mimetype = 'application/x-ndjson'
+    elif export_format == 'csv':
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            
+            for count, row in enumerate(iter_catalog_rows(), start=1):
+                writer.writerow(row)
+                # Enviar el buffer cada cierto número de filas
+                if count % EXPORT_BATCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            
+            yield buffer.getvalue()
+        
+        mimetype = 'text/csv'
+    else:
+        return jsonify({"error": "Formato inválido"}), 400
+    
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=productos.{export_format}'
+    return response
+
+
 # Rutas para gestión de stock
 @products_bp.route('/stock', methods=['GET'])
 @jwt_required()
@@ -387,6 +1182,7 @@ def update_stock(stock_id):
     try:
         # Actualizar cantidad
         if 'quantity' in data:
+            stock_ledger.set_context(MovementReason.ADJUSTMENT, actor_id=get_jwt_identity())
             stock.quantity = data['quantity']
         
         # Actualizar stock mínimo
@@ -394,6 +1190,7 @@ def update_stock(stock_id):
             stock.min_stock = data['min_stock']
         
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
         
         return jsonify({
             "message": "Stock actualizado correctamente",
@@ -429,6 +1226,7 @@ def create_branch():
         
         db.session.add(new_branch)
         db.session.commit()
+        catalog_cache.bump_version()
         
         return jsonify({
             "message": "Sucursal creada exitosamente",
@@ -459,6 +1257,7 @@ def update_branch(branch_id):
                 setattr(branch, field, data[field])
         
         db.session.commit()
+        catalog_cache.bump_version()
         
         return jsonify({
             "message": "Sucursal actualizada correctamente",
@@ -482,6 +1281,7 @@ def delete_branch(branch_id):
     try:
         db.session.delete(branch)
         db.session.commit()
+        catalog_cache.bump_version()
         return jsonify({"message": "Sucursal eliminada correctamente"}), 200
     except Exception as e:
         db.session.rollback()
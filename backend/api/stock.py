@@ -1,14 +1,29 @@
+import uuid
+from datetime import datetime
+
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy import and_, or_, func
 
 from app import db, sse
-from models.product import Product, Stock, Branch
+from models.product import Product, Stock, Branch, MovementReason, StockMovement
 from models.user import UserRole
 from utils.auth_utils import admin_required, role_required, has_role
+from utils.http_utils import conditional_response
+from utils.pagination import paginate_keyset
+from services.cache_service import catalog_cache, STOCK_VERSION
+from services.stock_ledger_service import stock_ledger
+from services.stock_service import stock_service
 
 stock_bp = Blueprint('stock', __name__)
 
+# Movimientos de stock por página como máximo
+MAX_MOVEMENTS_PER_PAGE = 200
+
+def parse_timestamp(value):
+    """Fecha ISO 8601 de un parámetro (None si falta); ValueError si es inválida"""
+    return datetime.fromisoformat(value) if value else None
+
 @stock_bp.route('', methods=['GET'])
 @jwt_required()
 def get_stocks():
@@ -80,6 +95,8 @@ def get_stocks():
             "branch_id": branch.id,
             "branch_name": branch.name,
             "quantity": stock.quantity,
+            "reserved": stock.reserved,
+            "available": stock.available(),
             "min_stock": stock.min_stock,
             "is_low_stock": stock.quantity <= stock.min_stock,
             "is_out_of_stock": stock.quantity <= 0,
@@ -112,6 +129,7 @@ def update_stock(stock_id):
         return jsonify({"error": "Stock no encontrado"}), 404
     
     try:
+        stock_ledger.set_context(MovementReason.ADJUSTMENT, actor_id=get_jwt_identity())
         old_quantity = stock.quantity
         stock.quantity = data['quantity']
         
@@ -153,6 +171,7 @@ def update_stock(stock_id):
                 }, type='stock_alert')
         
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
         
         return jsonify({
             "message": "Stock actualizado correctamente",
@@ -198,70 +217,59 @@ def transfer_stock():
     if data['quantity'] <= 0:
         return jsonify({"error": "La cantidad debe ser mayor a cero"}), 400
     
-    # Verificar stock origen
-    source_stock = Stock.query.filter_by(
-        product_id=data['product_id'], 
-        branch_id=data['source_branch_id']
-    ).first()
-    
-    if not source_stock or source_stock.quantity < data['quantity']:
-        return jsonify({"error": "Stock insuficiente en la sucursal origen"}), 400
-    
-    # Verificar o crear stock destino
-    target_stock = Stock.query.filter_by(
-        product_id=data['product_id'], 
-        branch_id=data['target_branch_id']
-    ).first()
-    
-    if not target_stock:
-        # Crear stock en sucursal destino
-        target_stock = Stock(
-            product_id=data['product_id'],
-            branch_id=data['target_branch_id'],
-            quantity=0,
-            min_stock=source_stock.min_stock
-        )
-        db.session.add(target_stock)
-    
     try:
-        # Actualizar cantidades
-        source_stock.quantity -= data['quantity']
-        target_stock.quantity += data['quantity']
+        # Ambos movimientos de la transferencia comparten la referencia
+        stock_ledger.set_context(
+            MovementReason.TRANSFER,
+            actor_id=get_jwt_identity(),
+            reference=f"TRF-{uuid.uuid4().hex[:12].upper()}"
+        )
         
-        # Verificar si el stock origen está bajo mínimo
-        if source_stock.quantity <= source_stock.min_stock:
-            # Enviar notificación SSE
-            product = Product.query.get(source_stock.product_id)
-            source_branch = Branch.query.get(source_stock.branch_id)
-            
-            if product and source_branch:
-                sse.publish({
-                    "product_id": product.id,
-                    "product_name": product.name,
-                    "branch_id": source_branch.id,
-                    "branch_name": source_branch.name,
-                    "current_stock": source_stock.quantity,
-                    "min_stock": source_stock.min_stock,
-                    "message": f"Stock bajo en {product.name} ({source_branch.name}) después de transferencia"
-                }, type='stock_alert')
+        # Salida condicionada al stock disponible y entrada con creación del
+        # registro de destino si falta, sin lecturas previas
+        transferred = stock_service.transfer(
+            data['product_id'], data['source_branch_id'], data['target_branch_id'], data['quantity']
+        )
+        if transferred is None:
+            db.session.rollback()
+            return jsonify({"error": "Stock insuficiente en la sucursal origen"}), 400
         
+        source, target_quantity = transferred
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
         
-        return jsonify({
-            "message": "Transferencia de stock realizada correctamente",
-            "transfer": {
-                "product_id": data['product_id'],
-                "source_branch_id": data['source_branch_id'],
-                "target_branch_id": data['target_branch_id'],
-                "quantity": data['quantity'],
-                "source_remaining": source_stock.quantity,
-                "target_new_quantity": target_stock.quantity
-            }
-        }), 200
-            
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
+    
+    # Verificar si el stock origen está bajo mínimo
+    if source.quantity <= source.min_stock:
+        # Enviar notificación SSE
+        product = Product.query.get(data['product_id'])
+        source_branch = Branch.query.get(data['source_branch_id'])
+        
+        if product and source_branch:
+            sse.publish({
+                "product_id": product.id,
+                "product_name": product.name,
+                "branch_id": source_branch.id,
+                "branch_name": source_branch.name,
+                "current_stock": source.quantity,
+                "min_stock": source.min_stock,
+                "message": f"Stock bajo en {product.name} ({source_branch.name}) después de transferencia"
+            }, type='stock_alert')
+    
+    return jsonify({
+        "message": "Transferencia de stock realizada correctamente",
+        "transfer": {
+            "product_id": data['product_id'],
+            "source_branch_id": data['source_branch_id'],
+            "target_branch_id": data['target_branch_id'],
+            "quantity": data['quantity'],
+            "source_remaining": source.quantity,
+            "target_new_quantity": target_quantity
+        }
+    }), 200
 
 
 @stock_bp.route('/bulk-update', methods=['POST'])
@@ -275,81 +283,91 @@ def bulk_update_stock():
     if not isinstance(data, list):
         return jsonify({"error": "Se espera un array de actualizaciones"}), 400
     
-    updates_result = []
+    # Una entrada por registro de stock (la última prevalece)
+    updates = {}
+    for update in data:
+        if not isinstance(update, dict) or not all(k in update for k in ('stock_id', 'quantity')):
+            continue
+        try:
+            updates[int(update['stock_id'])] = (update['quantity'], update.get('min_stock'))
+        except (TypeError, ValueError):
+            continue
     
     try:
-        for update in data:
-            if not all(k in update for k in ('stock_id', 'quantity')):
-                continue
-            
-            stock = Stock.query.get(update['stock_id'])
-            if not stock:
-                updates_result.append({
-                    "stock_id": update['stock_id'],
-                    "success": False,
-                    "error": "Stock no encontrado"
-                })
-                continue
-            
-            old_quantity = stock.quantity
-            stock.quantity = update['quantity']
-            
-            # Actualizar stock mínimo si se proporciona
-            if 'min_stock' in update:
-                stock.min_stock = update['min_stock']
-            
-            updates_result.append({
-                "stock_id": stock.id,
-                "product_id": stock.product_id,
-                "branch_id": stock.branch_id,
-                "old_quantity": old_quantity,
-                "new_quantity": stock.quantity,
-                "success": True
-            })
-            
-            # Verificar alertas de stock bajo
-            if stock.quantity <= stock.min_stock:
-                product = Product.query.get(stock.product_id)
-                branch = Branch.query.get(stock.branch_id)
-                
-                if product and branch:
-                    sse.publish({
-                        "product_id": product.id,
-                        "product_name": product.name,
-                        "branch_id": branch.id,
-                        "branch_name": branch.name,
-                        "current_stock": stock.quantity,
-                        "min_stock": stock.min_stock,
-                        "message": f"Stock bajo en {product.name} ({branch.name})"
-                    }, type='stock_alert')
+        stock_ledger.set_context(MovementReason.CYCLE_COUNT, actor_id=get_jwt_identity())
+        
+        # Carga, bloqueo y actualización de todos los registros en dos sentencias
+        changed = stock_service.set_quantities(updates)
         
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
         
-        return jsonify({
-            "message": "Actualización masiva de stock completada",
-            "updates": updates_result
-        }), 200
-            
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
+    
+    updates_result = []
+    low_stock = {}
+    for stock_id in updates:
+        stock = changed.get(stock_id)
+        if not stock:
+            updates_result.append({
+                "stock_id": stock_id,
+                "success": False,
+                "error": "Stock no encontrado"
+            })
+            continue
+        
+        updates_result.append({
+            "stock_id": stock_id,
+            "product_id": stock['product_id'],
+            "branch_id": stock['branch_id'],
+            "old_quantity": stock['old_quantity'],
+            "new_quantity": stock['new_quantity'],
+            "success": True
+        })
+        
+        if stock['new_quantity'] <= stock['min_stock']:
+            low_stock.setdefault(stock['branch_id'], []).append(stock)
+    
+    # Una alerta de stock bajo por sucursal con todos sus productos
+    for branch_id, stocks in low_stock.items():
+        branch_name = stocks[0]['branch_name']
+        sse.publish({
+            "branch_id": branch_id,
+            "branch_name": branch_name,
+            "products": [
+                {
+                    "product_id": stock['product_id'],
+                    "product_name": stock['product_name'],
+                    "current_stock": stock['new_quantity'],
+                    "min_stock": stock['min_stock']
+                } for stock in stocks
+            ],
+            "message": f"Stock bajo en {len(stocks)} productos ({branch_name})"
+        }, type='stock_alert')
+    
+    return jsonify({
+        "message": "Actualización masiva de stock completada",
+        "updates": updates_result
+    }), 200
+
+
+def stock_alerts_etag():
+    """Validador de ETag de alertas: versiones del stock y del catálogo"""
+    # Los nombres de productos y sucursales dependen de la versión del catálogo
+    version, stock_version = catalog_cache.get_version(), catalog_cache.get_version(STOCK_VERSION)
+    if version is None or stock_version is None:
+        return None
+    return f"{version}:{stock_version}"
 
 
 @stock_bp.route('/alerts', methods=['GET'])
 @jwt_required()
+@role_required([UserRole.ADMIN, UserRole.VENDOR, UserRole.WAREHOUSE])
+@conditional_response(stock_alerts_etag, private=True)
 def get_stock_alerts():
     """Obtener alertas de stock bajo"""
-    # Verificar roles permitidos
-    jwt_data = get_jwt()
-    role = jwt_data.get('role')
-    
-    if role not in [
-        UserRole.ADMIN.value, 
-        UserRole.VENDOR.value, 
-        UserRole.WAREHOUSE.value
-    ]:
-        return jsonify({"error": "No autorizado"}), 403
-    
     # Parámetros
     branch_id = request.args.get('branch_id', type=int)
     
@@ -405,59 +423,154 @@ def initialize_stock():
     if not product:
         return jsonify({"error": "Producto no encontrado"}), 404
     
-    # Obtener todas las sucursales
-    branches = Branch.query.all()
-    if not branches:
+    if not Branch.query.first():
         return jsonify({"error": "No hay sucursales registradas"}), 404
     
+    try:
+        stock_ledger.set_context(MovementReason.INITIAL, actor_id=get_jwt_identity())
+        
+        # Crear o actualizar el registro de cada sucursal en una sola sentencia
+        rows = stock_service.initialize(
+            data['quantity'], min_stock=data.get('min_stock'), product_id=product.id
+        )
+        
+        db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    
     results = []
+    for row in rows:
+        if row.created:
+            results.append({
+                "branch_id": row.branch_id,
+                "branch_name": row.branch_name,
+                "quantity": row.quantity,
+                "action": "created"
+            })
+        else:
+            results.append({
+                "branch_id": row.branch_id,
+                "branch_name": row.branch_name,
+                "old_quantity": row.old_quantity,
+                "new_quantity": row.quantity,
+                "action": "updated"
+            })
+    
+    return jsonify({
+        "message": f"Stock de {product.name} inicializado en todas las sucursales",
+        "results": results
+    }), 200
+
+
+@stock_bp.route('/initialize-branch', methods=['POST'])
+@jwt_required()
+@admin_required
+def initialize_branch_stock():
+    """Inicializar stock de todos los productos en una sucursal (p. ej. una sucursal nueva)"""
+    data = request.json
+    
+    # Validar datos
+    if not all(k in data for k in ('branch_id', 'quantity')):
+        return jsonify({"error": "Faltan datos requeridos"}), 400
+    
+    branch = Branch.query.get(data['branch_id'])
+    if not branch:
+        return jsonify({"error": "Sucursal no encontrada"}), 404
     
     try:
-        for branch in branches:
-            # Verificar si ya existe stock
-            stock = Stock.query.filter_by(
-                product_id=data['product_id'],
-                branch_id=branch.id
-            ).first()
-            
-            if stock:
-                # Actualizar stock existente
-                old_quantity = stock.quantity
-                stock.quantity = data['quantity']
-                if 'min_stock' in data:
-                    stock.min_stock = data['min_stock']
-                
-                results.append({
-                    "branch_id": branch.id,
-                    "branch_name": branch.name,
-                    "old_quantity": old_quantity,
-                    "new_quantity": stock.quantity,
-                    "action": "updated"
-                })
-            else:
-                # Crear nuevo stock
-                new_stock = Stock(
-                    product_id=data['product_id'],
-                    branch_id=branch.id,
-                    quantity=data['quantity'],
-                    min_stock=data.get('min_stock', 5)
-                )
-                db.session.add(new_stock)
-                
-                results.append({
-                    "branch_id": branch.id,
-                    "branch_name": branch.name,
-                    "quantity": new_stock.quantity,
-                    "action": "created"
-                })
+        stock_ledger.set_context(MovementReason.INITIAL, actor_id=get_jwt_identity())
+        
+        rows = stock_service.initialize(
+            data['quantity'], min_stock=data.get('min_stock'), branch_id=branch.id
+        )
         
         db.session.commit()
+        catalog_cache.bump_version(STOCK_VERSION)
         
-        return jsonify({
-            "message": f"Stock de {product.name} inicializado en todas las sucursales",
-            "results": results
-        }), 200
-            
     except Exception as e:
         db.session.rollback()
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+    
+    created = sum(1 for row in rows if row.created)
+    
+    return jsonify({
+        "message": f"Stock de {branch.name} inicializado para todos los productos",
+        "created": created,
+        "updated": len(rows) - created
+    }), 200
+
+
+@stock_bp.route('/movements', methods=['GET'])
+@jwt_required()
+@role_required([UserRole.ADMIN, UserRole.WAREHOUSE, UserRole.ACCOUNTANT])
+def get_stock_movements():
+    """Obtener movimientos de stock (más recientes primero, paginados por cursor)"""
+    per_page = min(request.args.get('per_page', 50, type=int), MAX_MOVEMENTS_PER_PAGE)
+    branch_id = request.args.get('branch_id', type=int)
+    product_id = request.args.get('product_id', type=int)
+    reason = request.args.get('reason')
+    
+    try:
+        date_from = parse_timestamp(request.args.get('from'))
+        date_to = parse_timestamp(request.args.get('to'))
+    except ValueError:
+        return jsonify({"error": "Fecha inválida"}), 400
+    
+    if reason and reason not in [r.value for r in MovementReason]:
+        return jsonify({"error": "Motivo inválido"}), 400
+    
+    query = StockMovement.query
+    
+    if branch_id:
+        query = query.filter(StockMovement.branch_id == branch_id)
+    if product_id:
+        query = query.filter(StockMovement.product_id == product_id)
+    if reason:
+        query = query.filter(StockMovement.reason == reason)
+    # El rango de fechas limita las particiones mensuales recorridas
+    if date_from:
+        query = query.filter(StockMovement.created_at >= date_from)
+    if date_to:
+        query = query.filter(StockMovement.created_at < date_to)
+    
+    sort_keys = [(StockMovement.created_at, True), (StockMovement.id, True)]
+    try:
+        movements, next_cursor = paginate_keyset(query, sort_keys, request.args.get('cursor'), per_page)
+    except ValueError:
+        return jsonify({"error": "Cursor inválido"}), 400
+    
+    return jsonify({
+        "movements": [movement.to_dict() for movement in movements],
+        "pagination": {
+            "per_page": per_page,
+            "next_cursor": next_cursor,
+            "has_next": next_cursor is not None
+        }
+    }), 200
+
+
+@stock_bp.route('/as-of', methods=['GET'])
+@jwt_required()
+@role_required([UserRole.ADMIN, UserRole.WAREHOUSE, UserRole.ACCOUNTANT])
+def get_stock_as_of():
+    """Obtener el stock de una sucursal a una fecha"""
+    branch_id = request.args.get('branch_id', type=int)
+    if not branch_id:
+        return jsonify({"error": "Se requiere especificar la sucursal"}), 400
+    
+    try:
+        at = parse_timestamp(request.args.get('at')) or datetime.utcnow()
+    except ValueError:
+        return jsonify({"error": "Fecha inválida"}), 400
+    
+    stocks, snapshot_at = stock_ledger.stock_as_of(branch_id, at)
+    
+    return jsonify({
+        "branch_id": branch_id,
+        "at": at.isoformat(),
+        "snapshot_at": snapshot_at.isoformat() if snapshot_at else None,
+        "stocks": stocks
+    }), 200
@@ -6,10 +6,20 @@ import os
 from datetime import datetime
 import json
 
+def create_tables():
+    """
+    Crea las tablas de los modelos que no existen
+
+    Omite las tablas marcadas con info['migration_only'] (p. ej. las
+    particionadas), cuya definición sólo existe en db/schemas.py.
+    """
+    tables = [table for table in db.metadata.sorted_tables if not table.info.get('migration_only')]
+    db.metadata.create_all(db.engine, tables=tables)
+
 def init_db():
     """Inicializa la base de datos con datos necesarios para el funcionamiento"""
     # Crear tablas si no existen
-    db.create_all()
+    create_tables()
     
     # Verificar si ya existen datos
     if User.query.first() is not None:
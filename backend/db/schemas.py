@@ -1,6 +1,82 @@
 from app import db
 from datetime import datetime
 
+# Vector de búsqueda ponderado de productos: nombre, marca y SKU pesan más
+# que la subcategoría, y esta más que la descripción
+PRODUCT_SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('es_unaccent', coalesce({row}name, '')), 'A') ||
+    setweight(to_tsvector('es_unaccent', coalesce({row}brand, '') || ' ' || coalesce({row}sku, '')), 'A') ||
+    setweight(to_tsvector('es_unaccent', coalesce({row}subcategory, '')), 'B') ||
+    setweight(to_tsvector('es_unaccent', coalesce({row}description, '')), 'C')
+"""
+
+# Texto sin acentos de nombre, marca y subcategoría para búsqueda por trigramas
+PRODUCT_SEARCH_TEXT_SQL = """
+    lower(unaccent(coalesce({row}name, '') || ' ' || coalesce({row}brand, '') || ' ' || coalesce({row}subcategory, '')))
+"""
+
+# Recalcula las filas de product_listing de los productos indicados (y borra
+# las de productos eliminados); {available} es la expresión de stock disponible
+PRODUCT_LISTING_REFRESH_SQL = """
+CREATE OR REPLACE FUNCTION refresh_product_listing(product_ids INTEGER[]) RETURNS void AS $$
+BEGIN
+    -- Bloquear primero las filas (en orden): si otra transacción está
+    -- actualizando el mismo producto, los agregados se calculan
+    -- después de que confirme y no se pierde su cambio
+    PERFORM 1 FROM product_listing WHERE id = ANY(product_ids) ORDER BY id FOR UPDATE;
+    
+    INSERT INTO product_listing (
+        id, sku, name, description, brand, brand_code, category, subcategory,
+        price, discount_percentage, current_price, is_featured, is_new, image_url,
+        popularity, total_stock, available_branches, created_at, refreshed_at,
+        search_vector, search_text
+    )
+    SELECT
+        p.id, p.sku, p.name, p.description, p.brand, p.brand_code, p.category, p.subcategory,
+        p.price, p.discount_percentage,
+        CASE WHEN p.discount_percentage > 0
+             THEN round(p.price * (1 - p.discount_percentage / 100.0), 2)
+             ELSE p.price END,
+        p.is_featured, p.is_new, p.image_url,
+        p.popularity, coalesce(s.total_stock, 0), coalesce(s.available_branches, '{{}}'),
+        p.created_at, now(), p.search_vector, p.search_text
+    FROM products p
+    LEFT JOIN LATERAL (
+        SELECT sum({available}) AS total_stock,
+               array_agg(branch_id ORDER BY branch_id) FILTER (WHERE {available} > 0) AS available_branches
+        FROM stocks
+        WHERE stocks.product_id = p.id
+    ) s ON true
+    WHERE p.id = ANY(product_ids)
+    ON CONFLICT (id) DO UPDATE SET
+        sku = EXCLUDED.sku,
+        name = EXCLUDED.name,
+        description = EXCLUDED.description,
+        brand = EXCLUDED.brand,
+        brand_code = EXCLUDED.brand_code,
+        category = EXCLUDED.category,
+        subcategory = EXCLUDED.subcategory,
+        price = EXCLUDED.price,
+        discount_percentage = EXCLUDED.discount_percentage,
+        current_price = EXCLUDED.current_price,
+        is_featured = EXCLUDED.is_featured,
+        is_new = EXCLUDED.is_new,
+        image_url = EXCLUDED.image_url,
+        popularity = EXCLUDED.popularity,
+        total_stock = EXCLUDED.total_stock,
+        available_branches = EXCLUDED.available_branches,
+        created_at = EXCLUDED.created_at,
+        refreshed_at = EXCLUDED.refreshed_at,
+        search_vector = EXCLUDED.search_vector,
+        search_text = EXCLUDED.search_text;
+    
+    DELETE FROM product_listing l
+    WHERE l.id = ANY(product_ids)
+      AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = l.id);
+END
+$$ LANGUAGE plpgsql
+"""
+
 def create_migration_table():
     """
     Crea una tabla de migraciones para llevar control de versiones de la base de datos
@@ -66,6 +142,61 @@ def run_migrations():
             'description': 'Agregar índices para búsqueda',
             'function': add_search_indexes
         },
+        {
+            'version': '1.0.2',
+            'description': 'Búsqueda de texto completo en productos',
+            'function': add_fulltext_search
+        },
+        {
+            'version': '1.0.3',
+            'description': 'Popularidad de productos e índices de ordenamiento del catálogo',
+            'function': add_catalog_sort_indexes
+        },
+        {
+            'version': '1.0.4',
+            'description': 'Índice de historial de precios por producto y fecha',
+            'function': add_price_history_index
+        },
+        {
+            'version': '1.0.5',
+            'description': 'Registro de cambios de productos para la API externa',
+            'function': add_product_change_log
+        },
+        {
+            'version': '1.0.6',
+            'description': 'Búsqueda aproximada de productos por trigramas',
+            'function': add_fuzzy_search
+        },
+        {
+            'version': '1.0.7',
+            'description': 'Índices de disponibilidad de stock por sucursal',
+            'function': add_stock_availability_indexes
+        },
+        {
+            'version': '1.0.8',
+            'description': 'Modelo de lectura desnormalizado del catálogo',
+            'function': add_product_listing
+        },
+        {
+            'version': '1.0.9',
+            'description': 'Reservas de stock de pedidos',
+            'function': add_stock_reservations
+        },
+        {
+            'version': '1.0.10',
+            'description': 'Registro de movimientos de stock y cierres periódicos',
+            'function': add_stock_ledger
+        },
+        {
+            'version': '1.0.11',
+            'description': 'Registro único de stock por producto y sucursal',
+            'function': add_stock_unique_constraint
+        },
+        {
+            'version': '1.0.12',
+            'description': 'Índices del catálogo por marca en product_listing',
+            'function': update_catalog_listing_indexes
+        },
         # Agregar aquí más migraciones según sea necesario
     ]
     
@@ -114,6 +245,668 @@ def add_search_indexes():
     db.engine.execute("CREATE INDEX IF NOT EXISTS idx_stock_branch ON stocks (branch_id)")
     db.engine.execute("CREATE INDEX IF NOT EXISTS idx_stock_product_branch ON stocks (product_id, branch_id)")
 
+def execute_concurrently(sql):
+    """
+    Ejecuta una sentencia fuera de transacción (requerido por CREATE INDEX CONCURRENTLY)
+    
+    Args:
+        sql: Sentencia SQL a ejecutar
+    """
+    db.engine.execution_options(isolation_level="AUTOCOMMIT").execute(sql)
+
+def execute_committed(sql):
+    """
+    Ejecuta y confirma un bloque DO o un SELECT de funciones con efectos
+    
+    db.engine.execute sólo confirma automáticamente las sentencias que
+    empiezan con INSERT, UPDATE, DELETE, CREATE, DROP o ALTER.
+    
+    Args:
+        sql: Sentencia SQL a ejecutar
+    """
+    db.engine.execution_options(isolation_level="AUTOCOMMIT").execute(sql)
+
+def add_fulltext_search():
+    """
+    Tercera migración: Búsqueda de texto completo en productos
+    
+    Crea una configuración de búsqueda en español que ignora acentos,
+    una columna tsvector ponderada mantenida por trigger y un índice GIN
+    construido sin bloquear escrituras sobre la tabla.
+    """
+    # Extensión para eliminar acentos
+    db.engine.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    
+    # Configuración de búsqueda: stemming en español sobre texto sin acentos
+    execute_committed("""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+            ALTER TEXT SEARCH CONFIGURATION es_unaccent
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+        END IF;
+    END
+    $$
+    """)
+    
+    # Columna con el vector de búsqueda
+    db.engine.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector")
+    
+    # Trigger que mantiene el vector en inserciones y actualizaciones
+    db.engine.execute(f"""
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {PRODUCT_SEARCH_VECTOR_SQL.format(row='NEW.')};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    db.engine.execute("DROP TRIGGER IF EXISTS products_search_vector_trigger ON products")
+    db.engine.execute("""
+    CREATE TRIGGER products_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF name, brand, sku, subcategory, description ON products
+        FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+    """)
+    
+    # Calcular el vector para los productos existentes
+    db.engine.execute(f"UPDATE products SET search_vector = {PRODUCT_SEARCH_VECTOR_SQL.format(row='')}")
+    
+    # Índice GIN sobre el vector, construido sin bloquear la tabla
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_search_vector "
+        "ON products USING gin (search_vector)"
+    )
+
+def add_catalog_sort_indexes():
+    """
+    Cuarta migración: Índices compuestos para los ordenamientos del catálogo
+    
+    Cada orden (precio, novedades, nombre, popularidad) tiene un índice
+    propio y combinado con los filtros de categoría y marca, terminado en
+    el id para que el orden sea total. Los órdenes descendentes se sirven
+    recorriendo el mismo índice en sentido inverso.
+    """
+    # Columna de popularidad calculada a partir de los pedidos existentes
+    db.engine.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS popularity INTEGER NOT NULL DEFAULT 0")
+    db.engine.execute("""
+    UPDATE products SET popularity = totals.quantity
+    FROM (
+        SELECT product_id, SUM(quantity) AS quantity
+        FROM order_items
+        GROUP BY product_id
+    ) AS totals
+    WHERE products.id = totals.product_id
+    """)
+    
+    sort_columns = {
+        'price': 'price',
+        'created': 'created_at',
+        'name': 'name',
+        'popularity': 'popularity'
+    }
+    
+    for suffix, column in sort_columns.items():
+        execute_concurrently(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_sort_{suffix} "
+            f"ON products ({column}, id)"
+        )
+        execute_concurrently(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_category_{suffix} "
+            f"ON products (category, {column}, id)"
+        )
+        execute_concurrently(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_brand_{suffix} "
+            f"ON products (brand, {column}, id)"
+        )
+
+def add_price_history_index():
+    """
+    Quinta migración: Índice para leer los últimos precios de un producto
+    
+    Permite obtener el historial acotado por fecha y cantidad con un
+    recorrido del índice, sin leer todo el historial del producto.
+    """
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_price_history_product_created "
+        "ON price_history (product_id, created_at, id)"
+    )
+
+def add_product_change_log():
+    """
+    Sexta migración: Registro de cambios de productos y precios
+    
+    Triggers escriben en product_changes cada alta, modificación o baja de
+    un producto (en los campos que expone la API externa) y cada nuevo
+    precio, junto con el id de la transacción que los produjo.
+    """
+    db.engine.execute("""
+    CREATE TABLE IF NOT EXISTS product_changes (
+        id BIGSERIAL PRIMARY KEY,
+        entity VARCHAR(10) NOT NULL,
+        operation VARCHAR(10) NOT NULL,
+        product_id INTEGER NOT NULL,
+        sku VARCHAR(50),
+        price_history_id INTEGER,
+        txid BIGINT NOT NULL,
+        changed_at TIMESTAMP NOT NULL
+    )
+    """)
+    db.engine.execute(
+        "CREATE INDEX IF NOT EXISTS idx_product_changes_txid ON product_changes (txid, id)"
+    )
+    
+    # Altas, bajas y cambios de productos; un cambio de SKU deja una baja del SKU anterior
+    db.engine.execute("""
+    CREATE OR REPLACE FUNCTION products_log_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') AND (TG_OP = 'DELETE' OR OLD.sku IS DISTINCT FROM NEW.sku) THEN
+            INSERT INTO product_changes (entity, operation, product_id, sku, txid, changed_at)
+            VALUES ('product', 'delete', OLD.id, OLD.sku, txid_current(), now());
+        END IF;
+        IF TG_OP = 'DELETE' THEN
+            RETURN OLD;
+        END IF;
+        INSERT INTO product_changes (entity, operation, product_id, sku, txid, changed_at)
+        VALUES ('product', 'upsert', NEW.id, NEW.sku, txid_current(), now());
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    db.engine.execute("DROP TRIGGER IF EXISTS products_change_log ON products")
+    db.engine.execute("DROP TRIGGER IF EXISTS products_change_log_update ON products")
+    db.engine.execute("""
+    CREATE TRIGGER products_change_log
+        AFTER INSERT OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION products_log_change()
+    """)
+    db.engine.execute("""
+    CREATE TRIGGER products_change_log_update
+        AFTER UPDATE OF sku, name, brand, brand_code ON products
+        FOR EACH ROW EXECUTE FUNCTION products_log_change()
+    """)
+    
+    # Nuevos precios
+    db.engine.execute("""
+    CREATE OR REPLACE FUNCTION price_history_log_change() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO product_changes (entity, operation, product_id, price_history_id, txid, changed_at)
+        VALUES ('price', 'insert', NEW.product_id, NEW.id, txid_current(), now());
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    db.engine.execute("DROP TRIGGER IF EXISTS price_history_change_log ON price_history")
+    db.engine.execute("""
+    CREATE TRIGGER price_history_change_log
+        AFTER INSERT ON price_history
+        FOR EACH ROW EXECUTE FUNCTION price_history_log_change()
+    """)
+    
+    # Punto de partida: un alta por cada producto existente
+    db.engine.execute("""
+    INSERT INTO product_changes (entity, operation, product_id, sku, txid, changed_at)
+    SELECT 'product', 'upsert', id, sku, txid_current(), now() FROM products
+    """)
+
+def add_fuzzy_search():
+    """
+    Séptima migración: Búsqueda aproximada (tolerante a errores de escritura)
+    
+    Agrega la columna search_text, mantenida por el mismo trigger que el
+    vector de búsqueda, y un índice GIN de trigramas sobre ella.
+    """
+    db.engine.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    db.engine.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS search_text TEXT")
+    
+    # El trigger existente pasa a mantener ambas columnas
+    db.engine.execute(f"""
+    CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {PRODUCT_SEARCH_VECTOR_SQL.format(row='NEW.')};
+        NEW.search_text := {PRODUCT_SEARCH_TEXT_SQL.format(row='NEW.')};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    
+    db.engine.execute(f"UPDATE products SET search_text = {PRODUCT_SEARCH_TEXT_SQL.format(row='')}")
+    
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_products_search_text_trgm "
+        "ON products USING gin (search_text gin_trgm_ops)"
+    )
+
+def add_stock_availability_indexes():
+    """
+    Octava migración: Índices parciales para filtrar el catálogo por disponibilidad
+    
+    Sólo incluyen filas con stock, de modo que el semi-join de
+    branch_id / in_stock recorre un índice pequeño y sin filas muertas.
+    El índice por updated_at resuelve el MAX() usado en los ETag de stock.
+    """
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stock_branch_product_available "
+        "ON stocks (branch_id, product_id) WHERE quantity > 0"
+    )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stock_product_available "
+        "ON stocks (product_id) WHERE quantity > 0"
+    )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_stock_updated_at ON stocks (updated_at)"
+    )
+
+def add_product_listing():
+    """
+    Novena migración: Modelo de lectura del catálogo (product_listing)
+    
+    Una fila por producto con precio efectivo, stock total, sucursales con
+    stock, popularidad y columnas de búsqueda. Triggers por sentencia sobre
+    products y stocks recalculan sólo los productos afectados, en la misma
+    transacción y con una consulta por sentencia (también en cargas masivas).
+    """
+    db.engine.execute("""
+    CREATE TABLE IF NOT EXISTS product_listing (
+        id INTEGER PRIMARY KEY,
+        sku VARCHAR(50) NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        description TEXT,
+        brand VARCHAR(50),
+        brand_code VARCHAR(50),
+        category productcategory NOT NULL,
+        subcategory VARCHAR(50),
+        price NUMERIC(10, 2) NOT NULL,
+        discount_percentage INTEGER,
+        current_price NUMERIC(12, 2) NOT NULL,
+        is_featured BOOLEAN,
+        is_new BOOLEAN,
+        image_url VARCHAR(255),
+        popularity INTEGER NOT NULL,
+        total_stock INTEGER NOT NULL,
+        available_branches INTEGER[] NOT NULL,
+        created_at TIMESTAMP,
+        refreshed_at TIMESTAMP NOT NULL,
+        search_vector TSVECTOR,
+        search_text TEXT
+    )
+    """)
+    
+    # Recalcula las filas de los productos indicados (y borra las de productos eliminados)
+    db.engine.execute(PRODUCT_LISTING_REFRESH_SQL.format(available='quantity'))
+    
+    # Funciones de trigger: productos afectados según las tablas de transición
+    db.engine.execute("""
+    CREATE OR REPLACE FUNCTION product_listing_products_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM refresh_product_listing(ARRAY(SELECT id FROM old_rows));
+        ELSE
+            PERFORM refresh_product_listing(ARRAY(SELECT id FROM new_rows));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    db.engine.execute("""
+    CREATE OR REPLACE FUNCTION product_listing_stocks_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM refresh_product_listing(ARRAY(SELECT DISTINCT product_id FROM new_rows));
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM refresh_product_listing(ARRAY(SELECT DISTINCT product_id FROM old_rows));
+        ELSE
+            PERFORM refresh_product_listing(ARRAY(
+                SELECT product_id FROM new_rows UNION SELECT product_id FROM old_rows
+            ));
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    
+    # Las tablas de transición exigen un trigger por evento
+    for table, function in (('products', 'product_listing_products_sync'),
+                            ('stocks', 'product_listing_stocks_sync')):
+        for event, referencing in (('INSERT', 'NEW TABLE AS new_rows'),
+                                   ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                                   ('DELETE', 'OLD TABLE AS old_rows')):
+            trigger = f"{table}_listing_{event.lower()}"
+            db.engine.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+            db.engine.execute(f"""
+            CREATE TRIGGER {trigger}
+                AFTER {event} ON {table}
+                REFERENCING {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {function}()
+            """)
+    
+    # Carga inicial
+    execute_committed("SELECT refresh_product_listing(ARRAY(SELECT id FROM products))")
+    
+    # Índices equivalentes a los del catálogo sobre products
+    for column in ('price', 'created_at', 'name', 'popularity'):
+        execute_concurrently(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_{column} "
+            f"ON product_listing ({column}, id)"
+        )
+        execute_concurrently(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_category_{column} "
+            f"ON product_listing (category, {column}, id)"
+        )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_brand "
+        "ON product_listing (brand)"
+    )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_search_vector "
+        "ON product_listing USING gin (search_vector)"
+    )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_search_text_trgm "
+        "ON product_listing USING gin (search_text gin_trgm_ops)"
+    )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_available_branches "
+        "ON product_listing USING gin (available_branches)"
+    )
+    execute_concurrently(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_in_stock "
+        "ON product_listing (id) WHERE total_stock > 0"
+    )
+
+def add_stock_reservations():
+    """
+    Décima migración: Reservas de stock de pedidos
+    
+    Agrega el contador stocks.reserved y la tabla stock_reservations (una
+    fila por producto de cada pedido). El modelo de lectura del catálogo
+    pasa a considerar disponible sólo quantity - reserved.
+    """
+    db.engine.execute("ALTER TABLE stocks ADD COLUMN IF NOT EXISTS reserved INTEGER NOT NULL DEFAULT 0")
+    execute_committed("""
+    DO $$
+    BEGIN
+        ALTER TABLE stocks ADD CONSTRAINT stocks_reserved_non_negative CHECK (reserved >= 0);
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END
+    $$
+    """)
+    
+    db.engine.execute("""
+    CREATE TABLE IF NOT EXISTS stock_reservations (
+        id SERIAL PRIMARY KEY,
+        order_id INTEGER NOT NULL REFERENCES orders (id),
+        product_id INTEGER NOT NULL REFERENCES products (id),
+        branch_id INTEGER NOT NULL REFERENCES branches (id),
+        quantity INTEGER NOT NULL,
+        expires_at TIMESTAMP,
+        created_at TIMESTAMP
+    )
+    """)
+    db.engine.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stock_reservations_order ON stock_reservations (order_id)"
+    )
+    # Sólo las reservas de pedidos pendientes vencen: índice parcial para el barrido
+    db.engine.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires "
+        "ON stock_reservations (expires_at) WHERE expires_at IS NOT NULL"
+    )
+    
+    db.engine.execute(PRODUCT_LISTING_REFRESH_SQL.format(available='quantity - reserved'))
+    execute_committed("SELECT refresh_product_listing(ARRAY(SELECT id FROM products))")
+
+def add_stock_ledger():
+    """
+    Undécima migración: Registro de movimientos de stock (ledger)
+    
+    stock_movements es de solo inserción y está particionada por mes; la
+    escribe un trigger por sentencia sobre stocks, con el motivo y las
+    referencias fijadas en la transacción (ver StockLedgerService). Los
+    cierres en stock_snapshots permiten calcular el stock a una fecha sin
+    recorrer todo el registro.
+    """
+    # Instalaciones donde db.create_all creó la tabla sin particionar (y sin
+    # secuencia, por lo que no pudo recibir filas): se reemplaza
+    execute_committed("""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_class
+            WHERE oid = to_regclass('stock_movements') AND relkind = 'r'
+        ) THEN
+            DROP TABLE stock_movements;
+        END IF;
+    END
+    $$
+    """)
+    db.engine.execute("""
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id BIGSERIAL,
+        created_at TIMESTAMP NOT NULL,
+        stock_id INTEGER,
+        product_id INTEGER NOT NULL,
+        branch_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        quantity_after INTEGER NOT NULL,
+        reason VARCHAR(20) NOT NULL,
+        actor_id INTEGER,
+        order_id INTEGER,
+        reference VARCHAR(50),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """)
+    # Red de seguridad si falta la partición del mes (ver create_stock_movement_partition)
+    db.engine.execute(
+        "CREATE TABLE IF NOT EXISTS stock_movements_default PARTITION OF stock_movements DEFAULT"
+    )
+    # Si el mes ya tiene filas en la partición por defecto, el CREATE
+    # fallaría: se desprende la partición por defecto, se trasladan sus
+    # filas del mes a la nueva y se vuelve a adjuntar (%% escapado para psycopg2)
+    db.engine.execute("""
+    CREATE OR REPLACE FUNCTION create_stock_movement_partition(month DATE) RETURNS void AS $$
+    DECLARE
+        month_start DATE := date_trunc('month', month)::date;
+        month_end DATE := (date_trunc('month', month) + interval '1 month')::date;
+        partition_name TEXT := 'stock_movements_' || to_char(date_trunc('month', month), 'YYYY_MM');
+    BEGIN
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            RETURN;
+        END IF;
+        
+        IF NOT EXISTS (
+            SELECT 1 FROM stock_movements_default
+            WHERE created_at >= month_start AND created_at < month_end
+        ) THEN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %%I PARTITION OF stock_movements FOR VALUES FROM (%%L) TO (%%L)',
+                partition_name, month_start, month_end
+            );
+            RETURN;
+        END IF;
+        
+        ALTER TABLE stock_movements DETACH PARTITION stock_movements_default;
+        EXECUTE format(
+            'CREATE TABLE %%I PARTITION OF stock_movements FOR VALUES FROM (%%L) TO (%%L)',
+            partition_name, month_start, month_end
+        );
+        EXECUTE format(
+            'INSERT INTO %%I SELECT * FROM stock_movements_default WHERE created_at >= %%L AND created_at < %%L',
+            partition_name, month_start, month_end
+        );
+        DELETE FROM stock_movements_default WHERE created_at >= month_start AND created_at < month_end;
+        ALTER TABLE stock_movements ATTACH PARTITION stock_movements_default DEFAULT;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    # Mes actual y los tres siguientes (ver StockLedgerService.ensure_partitions)
+    for months_ahead in range(4):
+        execute_committed(
+            f"SELECT create_stock_movement_partition((now() + interval '{months_ahead} month')::date)"
+        )
+    
+    # Índices en la tabla particionada: se crean en cada partición
+    db.engine.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stock_movements_branch_created "
+        "ON stock_movements (branch_id, created_at, id)"
+    )
+    db.engine.execute(
+        "CREATE INDEX IF NOT EXISTS idx_stock_movements_product_branch_created "
+        "ON stock_movements (product_id, branch_id, created_at)"
+    )
+    
+    db.engine.execute("""
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        branch_id INTEGER NOT NULL,
+        taken_at TIMESTAMP NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (branch_id, taken_at, product_id)
+    )
+    """)
+    
+    # Un movimiento por cada registro de stock cuya cantidad cambió en la sentencia
+    db.engine.execute("""
+    CREATE OR REPLACE FUNCTION stocks_log_movement() RETURNS trigger AS $$
+    DECLARE
+        v_reason TEXT := coalesce(nullif(current_setting('ferremas.stock_reason', true), ''), 'ajuste');
+        v_actor INTEGER := nullif(current_setting('ferremas.stock_actor', true), '')::integer;
+        v_order INTEGER := nullif(current_setting('ferremas.stock_order', true), '')::integer;
+        v_reference TEXT := nullif(current_setting('ferremas.stock_reference', true), '');
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO stock_movements (created_at, stock_id, product_id, branch_id, delta, quantity_after,
+                                         reason, actor_id, order_id, reference)
+            SELECT now() AT TIME ZONE 'utc', n.id, n.product_id, n.branch_id, n.quantity, n.quantity,
+                   v_reason, v_actor, v_order, v_reference
+            FROM new_rows n
+            WHERE coalesce(n.quantity, 0) <> 0;
+        ELSIF TG_OP = 'UPDATE' THEN
+            INSERT INTO stock_movements (created_at, stock_id, product_id, branch_id, delta, quantity_after,
+                                         reason, actor_id, order_id, reference)
+            SELECT now() AT TIME ZONE 'utc', n.id, n.product_id, n.branch_id,
+                   coalesce(n.quantity, 0) - coalesce(o.quantity, 0), coalesce(n.quantity, 0),
+                   v_reason, v_actor, v_order, v_reference
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            WHERE n.quantity IS DISTINCT FROM o.quantity;
+        ELSE
+            INSERT INTO stock_movements (created_at, stock_id, product_id, branch_id, delta, quantity_after,
+                                         reason, actor_id, order_id, reference)
+            SELECT now() AT TIME ZONE 'utc', o.id, o.product_id, o.branch_id, -o.quantity, 0,
+                   v_reason, v_actor, v_order, v_reference
+            FROM old_rows o
+            WHERE coalesce(o.quantity, 0) <> 0;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    for event, referencing in (('INSERT', 'NEW TABLE AS new_rows'),
+                               ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                               ('DELETE', 'OLD TABLE AS old_rows')):
+        trigger = f"stocks_movement_{event.lower()}"
+        db.engine.execute(f"DROP TRIGGER IF EXISTS {trigger} ON stocks")
+        db.engine.execute(f"""
+        CREATE TRIGGER {trigger}
+            AFTER {event} ON stocks
+            REFERENCING {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION stocks_log_movement()
+        """)
+    
+    # Punto de partida: el stock actual como movimiento inicial
+    db.engine.execute("""
+    INSERT INTO stock_movements (created_at, stock_id, product_id, branch_id, delta, quantity_after, reason)
+    SELECT now() AT TIME ZONE 'utc', id, product_id, branch_id, quantity, quantity, 'inicial'
+    FROM stocks
+    WHERE coalesce(quantity, 0) <> 0
+      AND NOT EXISTS (SELECT 1 FROM stock_movements)
+    """)
+
+def add_stock_unique_constraint():
+    """
+    Duodécima migración: Un registro de stock por producto y sucursal
+    
+    Fusiona los registros duplicados en el de menor id (sumando cantidades
+    y reservas; las reservas apuntan a producto y sucursal, no al registro)
+    y agrega la restricción única usada por los INSERT ... ON CONFLICT.
+    Los movimientos de la fusión quedan en el registro como ajuste.
+    """
+    execute_committed("""
+    DO $$
+    BEGIN
+        PERFORM set_config('ferremas.stock_reason', 'ajuste', true);
+        PERFORM set_config('ferremas.stock_reference', 'fusion-duplicados', true);
+        
+        WITH duplicated AS (
+            SELECT product_id, branch_id, min(id) AS keep_id,
+                   sum(coalesce(quantity, 0)) AS quantity,
+                   sum(reserved) AS reserved,
+                   max(min_stock) AS min_stock
+            FROM stocks
+            GROUP BY product_id, branch_id
+            HAVING count(*) > 1
+        )
+        UPDATE stocks st SET
+            quantity = d.quantity,
+            reserved = d.reserved,
+            min_stock = d.min_stock,
+            updated_at = now() AT TIME ZONE 'utc'
+        FROM duplicated d
+        WHERE st.id = d.keep_id;
+        
+        DELETE FROM stocks st
+        USING stocks kept
+        WHERE kept.product_id = st.product_id
+          AND kept.branch_id = st.branch_id
+          AND kept.id < st.id;
+    END
+    $$
+    """)
+    
+    # La restricción reemplaza al índice no único sobre las mismas columnas
+    execute_committed("""
+    DO $$
+    BEGIN
+        ALTER TABLE stocks ADD CONSTRAINT uq_stocks_product_branch UNIQUE (product_id, branch_id);
+    EXCEPTION WHEN duplicate_table OR duplicate_object THEN NULL;
+    END
+    $$
+    """)
+    db.engine.execute("DROP INDEX IF EXISTS idx_stock_product_branch")
+
+def update_catalog_listing_indexes():
+    """
+    Decimotercera migración: Índices de ordenamiento por marca en product_listing
+    
+    Completa los índices del modelo de lectura con (brand, orden, id), para
+    que las páginas filtradas por marca sigan siendo recorridos de índice,
+    y elimina los índices que el catálogo dejó de usar al leer
+    product_listing: los de ordenamiento sobre products y los parciales de
+    stock (su condición quantity > 0 ya no coincide con el stock disponible,
+    quantity - reserved), además del índice por updated_at de los antiguos
+    ETag de stock.
+    """
+    for column in ('price', 'created_at', 'name', 'popularity'):
+        execute_concurrently(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_listing_brand_{column} "
+            f"ON product_listing (brand, {column}, id)"
+        )
+    
+    unused_indexes = ['idx_product_listing_brand']
+    for suffix in ('price', 'created', 'name', 'popularity'):
+        unused_indexes += [
+            f'idx_products_sort_{suffix}',
+            f'idx_products_category_{suffix}',
+            f'idx_products_brand_{suffix}'
+        ]
+    unused_indexes += [
+        'idx_stock_branch_product_available',
+        'idx_stock_product_available',
+        'idx_stock_updated_at'
+    ]
+    for index in unused_indexes:
+        execute_concurrently(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
 if __name__ == "__main__":
     # Esto permite ejecutar las migraciones directamente
     from app import app
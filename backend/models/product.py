@@ -1,5 +1,8 @@
 from datetime import datetime
 import enum
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+from sqlalchemy.orm import deferred
 from app import db
 
 class ProductCategory(enum.Enum):
@@ -28,8 +31,14 @@ class Product(db.Model):
     is_featured = db.Column(db.Boolean, default=False)
     is_new = db.Column(db.Boolean, default=False)
     image_url = db.Column(db.String(255))
+    # Unidades pedidas históricamente (orden "popularidad" del catálogo)
+    popularity = db.Column(db.Integer, default=0, nullable=False, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Vector de búsqueda mantenido por trigger (ver db/schemas.py:add_fulltext_search)
+    search_vector = deferred(db.Column(TSVECTOR))
+    # Nombre, marca y subcategoría sin acentos para búsqueda aproximada (trigramas)
+    search_text = deferred(db.Column(db.Text))
     
     # Relaciones
     stocks = db.relationship('Stock', backref='product', lazy=True, cascade="all, delete-orphan")
@@ -45,11 +54,16 @@ class Product(db.Model):
             if hasattr(self, key):
                 setattr(self, key, value)
     
+    @staticmethod
+    def compute_price(price, discount_percentage):
+        """Calcula el precio con descuento a partir de valores de columna"""
+        if discount_percentage and discount_percentage > 0:
+            return float(price) * (1 - (discount_percentage / 100))
+        return float(price)
+    
     def current_price(self):
         """Calcula el precio actual con descuento si aplica"""
-        if self.discount_percentage > 0:
-            return float(self.price) * (1 - (self.discount_percentage / 100))
-        return float(self.price)
+        return Product.compute_price(self.price, self.discount_percentage)
     
     def to_dict(self):
         """Convierte el producto a diccionario (para API)"""
@@ -71,8 +85,18 @@ class Product(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
         }
     
-    def to_api_dict(self):
-        """Formato para la API externa según requisitos"""
+    def to_api_dict(self, prices=None):
+        """
+        Formato para la API externa según requisitos
+        
+        Args:
+            prices: Últimos registros de PriceHistory ya cargados
+                (ver PriceHistory.latest_for_products); si no se entregan
+                se consultan para este producto
+        """
+        if prices is None:
+            prices = PriceHistory.latest_for_products([self.id]).get(self.id, [])
+        
         return {
             'Código del producto': self.sku,
             'Marca': self.brand,
@@ -82,18 +106,24 @@ class Product(db.Model):
                 {
                     'Fecha': price_record.created_at.isoformat(),
                     'Valor': float(price_record.price)
-                } for price_record in self.price_history[-5:]  # Últimos 5 precios
+                } for price_record in prices
             ]
         }
 
 
 class Stock(db.Model):
     __tablename__ = 'stocks'
+    # Un registro por producto y sucursal (ver db/schemas.py:add_stock_unique_constraint)
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'branch_id', name='uq_stocks_product_branch'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
     quantity = db.Column(db.Integer, default=0)
+    # Unidades reservadas por pedidos aún no entregados (ver StockReservation)
+    reserved = db.Column(db.Integer, default=0, nullable=False, server_default='0')
     min_stock = db.Column(db.Integer, default=5)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -107,6 +137,10 @@ class Stock(db.Model):
         """Verifica si el stock está bajo el mínimo"""
         return self.quantity <= self.min_stock
     
+    def available(self):
+        """Unidades disponibles para nuevos pedidos"""
+        return self.quantity - (self.reserved or 0)
+    
     def to_dict(self):
         """Convierte el stock a diccionario (para API)"""
         return {
@@ -114,12 +148,95 @@ class Stock(db.Model):
             'product_id': self.product_id,
             'branch_id': self.branch_id,
             'quantity': self.quantity,
+            'reserved': self.reserved or 0,
+            'available': self.available(),
             'min_stock': self.min_stock,
             'is_low_stock': self.is_low_stock(),
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
 
 
+class StockReservation(db.Model):
+    """
+    Stock reservado por un pedido en una sucursal
+
+    Las filas las escribe StockService junto con el contador
+    Stock.reserved. Mientras el pedido está pendiente la reserva vence
+    en expires_at; al aprobarse queda sin vencimiento hasta la entrega.
+    """
+    __tablename__ = 'stock_reservations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MovementReason(enum.Enum):
+    INITIAL = "inicial"
+    ADJUSTMENT = "ajuste"
+    CYCLE_COUNT = "inventario"
+    TRANSFER = "transferencia"
+    SALE = "venta"
+    IMPORT = "importacion"
+
+
+class StockMovement(db.Model):
+    """
+    Movimiento de stock (registro de solo inserción, particionado por mes)
+
+    Las filas las escribe un trigger sobre stocks (ver
+    db/schemas.py:add_stock_ledger) en la misma transacción que el cambio;
+    el motivo, el usuario y las referencias se toman del contexto fijado
+    con StockLedgerService.set_context.
+    """
+    __tablename__ = 'stock_movements'
+    # Tabla particionada: la crea sólo la migración, no db.create_all
+    # (ver db/initialize.py:create_tables)
+    __table_args__ = {'info': {'migration_only': True}}
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    stock_id = db.Column(db.Integer)
+    product_id = db.Column(db.Integer, nullable=False)
+    branch_id = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    quantity_after = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # valores de MovementReason
+    actor_id = db.Column(db.Integer)
+    order_id = db.Column(db.Integer)
+    reference = db.Column(db.String(50))
+    
+    def to_dict(self):
+        """Convierte el movimiento a diccionario (para API)"""
+        return {
+            'id': self.id,
+            'stock_id': self.stock_id,
+            'product_id': self.product_id,
+            'branch_id': self.branch_id,
+            'delta': self.delta,
+            'quantity_after': self.quantity_after,
+            'reason': self.reason,
+            'actor_id': self.actor_id,
+            'order_id': self.order_id,
+            'reference': self.reference,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class StockSnapshot(db.Model):
+    """Stock de cada producto en una sucursal al cierre de un período"""
+    __tablename__ = 'stock_snapshots'
+    
+    branch_id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+
+
 class Branch(db.Model):
     __tablename__ = 'branches'
     
@@ -166,4 +283,130 @@ class PriceHistory(db.Model):
     
     def __init__(self, product_id, price):
         self.product_id = product_id
-        self.price = price
\ No newline at end of file
+        self.price = price
+    
+    @classmethod
+    def latest_for_products(cls, product_ids, limit=5):
+        """
+        Obtiene los últimos precios de varios productos en una sola consulta
+        
+        Args:
+            product_ids: IDs de los productos
+            limit: Cantidad de registros por producto
+            
+        Returns:
+            dict: product_id -> lista de PriceHistory en orden cronológico
+        """
+        result = {product_id: [] for product_id in product_ids}
+        if not product_ids:
+            return result
+        
+        # Numerar el historial de cada producto desde el registro más reciente
+        position = func.row_number().over(
+            partition_by=cls.product_id,
+            order_by=(cls.created_at.desc(), cls.id.desc())
+        ).label('position')
+        ranked = db.session.query(cls.id, position).filter(
+            cls.product_id.in_(product_ids)
+        ).subquery()
+        
+        records = cls.query.join(ranked, cls.id == ranked.c.id).filter(
+            ranked.c.position <= limit
+        ).order_by(cls.product_id, cls.created_at, cls.id).all()
+        
+        for record in records:
+            result[record.product_id].append(record)
+        return result
+
+class ProductChange(db.Model):
+    """
+    Registro de cambios de productos y precios para sincronización incremental
+    
+    Las filas las escriben triggers de la base de datos (ver
+    db/schemas.py:add_product_change_log) en la misma transacción que el
+    cambio; txid identifica esa transacción para leer el registro en un
+    orden que no omite cambios confirmados tarde.
+    """
+    __tablename__ = 'product_changes'
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    entity = db.Column(db.String(10), nullable=False)  # product, price
+    operation = db.Column(db.String(10), nullable=False)  # upsert, delete, insert
+    product_id = db.Column(db.Integer, nullable=False)
+    sku = db.Column(db.String(50))
+    price_history_id = db.Column(db.Integer)
+    txid = db.Column(db.BigInteger, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+class ProductListing(db.Model):
+    """
+    Modelo de lectura del catálogo: una fila por producto, ya desnormalizada
+
+    Incluye el precio efectivo, el stock total y las sucursales con stock,
+    de modo que el listado lee una sola tabla indexada. Las filas las
+    mantienen triggers sobre products y stocks (ver
+    db/schemas.py:add_product_listing) en la misma transacción que el cambio.
+    """
+    __tablename__ = 'product_listing'
+    
+    id = db.Column(db.Integer, primary_key=True)  # id del producto
+    sku = db.Column(db.String(50), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    brand = db.Column(db.String(50))
+    brand_code = db.Column(db.String(50))
+    category = db.Column(db.Enum(ProductCategory), nullable=False)
+    subcategory = db.Column(db.String(50))
+    price = db.Column(db.Numeric(10, 2), nullable=False)
+    discount_percentage = db.Column(db.Integer)
+    current_price = db.Column(db.Numeric(12, 2), nullable=False)
+    is_featured = db.Column(db.Boolean)
+    is_new = db.Column(db.Boolean)
+    image_url = db.Column(db.String(255))
+    popularity = db.Column(db.Integer, nullable=False)
+    total_stock = db.Column(db.Integer, nullable=False)
+    # Ids de sucursales con stock disponible
+    available_branches = db.Column(ARRAY(db.Integer), nullable=False)
+    created_at = db.Column(db.DateTime)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+    search_vector = deferred(db.Column(TSVECTOR))
+    search_text = deferred(db.Column(db.Text))
+    
+    @classmethod
+    def list_columns(cls):
+        """Columnas del listado, con las mismas claves que to_dict"""
+        return [
+            cls.id, cls.sku, cls.name, cls.description, cls.brand, cls.brand_code,
+            cls.category, cls.subcategory, cls.price, cls.current_price,
+            cls.discount_percentage, cls.is_featured, cls.is_new, cls.image_url,
+            cls.created_at
+        ]
+    
+    def to_dict(self):
+        """
+        Convierte la fila a diccionario con el formato de Product.to_dict
+
+        No incluye el stock: las respuestas cacheadas con la versión del
+        catálogo no deben cambiar con cada reserva (total_stock y
+        available_branches sólo se usan para filtrar).
+        """
+        return {
+            'id': self.id,
+            'sku': self.sku,
+            'name': self.name,
+            'description': self.description,
+            'brand': self.brand,
+            'brand_code': self.brand_code,
+            'category': self.category.value,
+            'subcategory': self.subcategory,
+            'price': float(self.price),
+            'current_price': float(self.current_price),
+            'discount_percentage': self.discount_percentage,
+            'is_featured': self.is_featured,
+            'is_new': self.is_new,
+            'image_url': self.image_url,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+    
+    # Mismo formato de la API externa: sólo usa id, sku, marca, código y nombre
+    to_api_dict = Product.to_api_dict
@@ -1,5 +1,6 @@
 import os
 import argparse
+import time
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -15,6 +16,9 @@ def main():
     parser.add_argument('--debug', action='store_true', help='Ejecutar en modo debug')
     parser.add_argument('--init-db', action='store_true', help='Inicializar la base de datos')
     parser.add_argument('--migrate', action='store_true', help='Ejecutar migraciones de la base de datos')
+    parser.add_argument('--import-products', metavar='ARCHIVO', help='Importar productos desde un archivo CSV o NDJSON')
+    parser.add_argument('--sweep-reservations', action='store_true', help='Cancelar periódicamente los pedidos con reserva de stock vencida')
+    parser.add_argument('--stock-snapshots', action='store_true', help='Crear particiones del registro de movimientos y el cierre diario de stock')
     parser.add_argument('--env', default='development', choices=['development', 'testing', 'production'], 
                        help='Entorno de ejecución (development, testing, production)')
     
@@ -32,8 +36,8 @@ def main():
     # Manejar inicialización de base de datos
     if args.init_db:
         with app.app_context():
-            db.create_all()
-            from db.initialize import init_db
+            from db.initialize import create_tables, init_db
+            create_tables()
             init_db()
         print("Base de datos inicializada")
         return
@@ -46,6 +50,54 @@ def main():
         print("Migraciones aplicadas")
         return
     
+    # Manejar importación de productos
+    if args.import_products:
+        with app.app_context():
+            from services.import_service import ProductImportService
+            from services.cache_service import catalog_cache
+            
+            file_format = 'ndjson' if args.import_products.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+            with open(args.import_products, encoding='utf-8-sig', newline='') as stream:
+                summary = ProductImportService().import_stream(stream, file_format)
+            catalog_cache.bump_version()
+        
+        print(f"Filas procesadas: {summary['total']}")
+        print(f"Productos creados: {summary['inserted']}, actualizados: {summary['updated']}")
+        print(f"Cambios de precio registrados: {summary['price_changes']}")
+        print(f"Filas con errores: {summary['failed']}")
+        for error in summary['errors']:
+            print(f"  Fila {error['row']} ({error['sku']}): {'; '.join(error['errors'])}")
+        return
+    
+    # Cierre diario de stock (p. ej. desde cron, poco después de medianoche UTC)
+    if args.stock_snapshots:
+        with app.app_context():
+            from services.stock_ledger_service import stock_ledger
+            
+            stock_ledger.ensure_partitions()
+            rows = stock_ledger.take_snapshots()
+        print(f"Filas de cierre de stock registradas: {rows}")
+        return
+    
+    # Barrido de reservas vencidas (proceso aparte, p. ej. un servicio del sistema)
+    if args.sweep_reservations:
+        from services.stock_service import stock_service
+        
+        interval = int(os.getenv('RESERVATION_SWEEP_INTERVAL', 60))
+        print(f"Barrido de reservas vencidas cada {interval} segundos")
+        while True:
+            with app.app_context():
+                try:
+                    expired = stock_service.expire_reservations()
+                    if expired:
+                        print(f"Pedidos cancelados por reserva vencida: {expired}")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error en el barrido de reservas: {e}")
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+    
     # Ejecutar la aplicación
     app.run(host=args.host, port=args.port, debug=args.debug)
 
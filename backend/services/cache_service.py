@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+import redis
+from flask import current_app, make_response, request
+
+# Segundos sin intentar usar Redis después de una falla de conexión
+REDIS_RETRY_SECONDS = 5
+
+# Contadores de versión: catálogo (productos, precios, sucursales), stock
+# y popularidad (acumulada con cada pedido)
+CATALOG_VERSION = 'version'
+STOCK_VERSION = 'stock_version'
+POPULARITY_VERSION = 'popularity_version'
+
+class CacheService:
+    """
+    Caché de respuestas versionada, compartida entre workers mediante Redis
+
+    Cada clave incluye el número de versión del catálogo; al incrementarlo
+    (después de confirmar una escritura) todas las entradas anteriores
+    quedan obsoletas en todos los workers y expiran solas por TTL. Si Redis
+    no está disponible no hay versión compartida: las respuestas se
+    entregan sin caché y sin ETag hasta que vuelva.
+    """
+
+    def __init__(self, namespace, default_ttl=60):
+        """
+        Inicializar caché
+
+        Args:
+            namespace: Prefijo de las claves en Redis
+            default_ttl: Segundos de vigencia por defecto de cada entrada
+        """
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self._redis = None
+        self._redis_retry_at = 0
+        self._pending_bumps = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'errors': 0,
+            'hit_time': 0.0,
+            'miss_time': 0.0
+        }
+
+    def _client(self):
+        """Cliente Redis (creado al primer uso a partir de REDIS_URL)"""
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                current_app.config['REDIS_URL'],
+                socket_timeout=0.1,
+                socket_connect_timeout=0.1
+            )
+        return self._redis
+
+    def _call(self, command, *args, **kwargs):
+        """
+        Ejecutar un comando Redis sin propagar errores de conexión
+
+        Returns:
+            tuple: (True, resultado) o (False, None) si Redis no está disponible
+        """
+        if time.monotonic() < self._redis_retry_at:
+            return False, None
+        try:
+            return True, getattr(self._client(), command)(*args, **kwargs)
+        except redis.RedisError:
+            self._record_error()
+            self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+            return False, None
+
+    def _record(self, kind, elapsed):
+        counter = 'hits' if kind == 'hit' else 'misses'
+        with self._lock:
+            self._stats[counter] += 1
+            self._stats[kind + '_time'] += elapsed
+
+    def _record_error(self):
+        with self._lock:
+            self._stats['errors'] += 1
+
+    def _seed_version(self, key):
+        """
+        Crear un contador ausente (p. ej. Redis reiniciado sin persistencia)
+
+        Parte de la hora actual en milisegundos, mayor que cualquier versión
+        ya entregada, para que un ETag o una clave anterior no vuelvan a
+        coincidir con datos distintos.
+
+        Returns:
+            bool: False si Redis no está disponible
+        """
+        ok, _ = self._call('set', key, int(time.time() * 1000), nx=True)
+        return ok
+
+    def _apply_pending_bumps(self):
+        """
+        Aplicar los incrementos que fallaron mientras Redis no respondía
+
+        Returns:
+            bool: False si Redis sigue sin estar disponible
+        """
+        with self._lock:
+            pending = list(self._pending_bumps)
+        for name in pending:
+            key = f"{self.namespace}:{name}"
+            if not self._seed_version(key) or not self._call('incr', key)[0]:
+                return False
+            with self._lock:
+                self._pending_bumps.discard(name)
+        return True
+
+    def get_version(self, name=CATALOG_VERSION):
+        """
+        Versión actual del catálogo (o del contador indicado, p. ej. STOCK_VERSION)
+
+        Returns:
+            int o None si Redis no está disponible (sin versión compartida
+            no se cachea ni se valida con ETag)
+        """
+        if not self._apply_pending_bumps():
+            return None
+
+        key = f"{self.namespace}:{name}"
+        ok, version = self._call('get', key)
+        if ok and version is None:
+            ok = self._seed_version(key)
+            if ok:
+                ok, version = self._call('get', key)
+        return int(version) if ok else None
+
+    def bump_version(self, name=CATALOG_VERSION):
+        """
+        Invalidar las entradas que dependen de un contador incrementándolo
+
+        La versión del catálogo forma parte de todas las claves; la del
+        stock, sólo de las que la incluyen mediante un validador. Debe
+        llamarse después de confirmar (commit) la transacción que modifica
+        los datos cacheados: una lectura concurrente que guarde datos
+        anteriores lo hace con la versión previa. Si Redis no responde, el
+        incremento queda pendiente y se aplica antes de volver a leer una
+        versión en este worker.
+
+        Args:
+            name: Contador a incrementar (CATALOG_VERSION, STOCK_VERSION o
+                POPULARITY_VERSION)
+        """
+        with self._lock:
+            self._pending_bumps.add(name)
+        self._apply_pending_bumps()
+
+    def make_key(self, prefix, params):
+        """
+        Construye una clave versionada a partir de parámetros de consulta
+
+        El orden de los parámetros y los valores vacíos no afectan la clave,
+        de modo que solicitudes equivalentes comparten la misma entrada.
+
+        Args:
+            prefix: Prefijo que identifica el tipo de resultado
+            params: Diccionario de parámetros a listas de valores
+
+        Returns:
+            str: Clave de caché o None si no hay versión (Redis no disponible)
+        """
+        version = self.get_version()
+        if version is None:
+            return None
+
+        normalized = {}
+        for key in sorted(params):
+            values = [str(v).strip() for v in params[key]]
+            values = [v for v in values if v]
+            if values:
+                normalized[key] = values
+
+        digest = hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+        return f"{self.namespace}:{prefix}:v{version}:{digest}"
+
+    def get(self, key):
+        """
+        Obtener un valor vigente de la caché
+
+        Returns:
+            bytes o None si no existe o expiró
+        """
+        _, value = self._call('get', key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Guardar un valor en la caché
+
+        Args:
+            key: Clave de caché
+            value: Valor a guardar (bytes)
+            ttl: Segundos de vigencia (None para usar el valor por defecto)
+        """
+        ttl = ttl if ttl is not None else self.default_ttl
+        self._call('set', key, value, ex=ttl)
+
+    def cached(self, prefix, ttl=None, include=None, validator=None):
+        """
+        Decorador que cachea la respuesta JSON de un endpoint GET
+
+        La clave considera los argumentos de la ruta y los parámetros de
+        la consulta. Sólo se guardan respuestas 200; el cuerpo se guarda ya
+        serializado para no volver a construirlo en cada acierto. Sin Redis
+        la respuesta se entrega sin caché (X-Cache: BYPASS).
+
+        Args:
+            prefix: Prefijo que identifica el endpoint
+            ttl: Segundos de vigencia (None para usar el valor por defecto)
+            include: Parámetros de consulta a considerar (None para todos)
+            validator: Función opcional que recibe los argumentos de la ruta
+                y devuelve un valor adicional para la clave, para datos que
+                cambian sin incrementar la versión (p. ej. stock); si
+                devuelve None la respuesta no se cachea
+        """
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                params = {
+                    k: v for k, v in request.args.lists()
+                    if include is None or k in include
+                }
+                # Los argumentos de la ruta (p. ej. el id) también forman parte de la clave
+                params.update({f"_{k}": [v] for k, v in kwargs.items()})
+                token = validator(*args, **kwargs) if validator is not None else ''
+                params['_validator'] = [token]
+                key = self.make_key(prefix, params) if token is not None else None
+
+                if key is None:
+                    # Sin versión compartida una entrada no podría invalidarse
+                    response = make_response(fn(*args, **kwargs))
+                    response.headers['X-Cache'] = 'BYPASS'
+                    return response
+
+                body = self.get(key)
+                if body is not None:
+                    response = current_app.response_class(body, status=200, mimetype='application/json')
+                    response.headers['X-Cache'] = 'HIT'
+                    self._record('hit', time.perf_counter() - start)
+                    return response
+
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code == 200:
+                    self.set(key, response.get_data(), ttl)
+                response.headers['X-Cache'] = 'MISS'
+                self._record('miss', time.perf_counter() - start)
+                return response
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        """
+        Métricas de la caché en este worker
+
+        Returns:
+            dict: Aciertos, fallos, tasa de aciertos y latencias promedio (ms)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        return {
+            'pid': os.getpid(),
+            'version': self.get_version(),
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'errors': stats['errors'],
+            'hit_ratio': stats['hits'] / lookups if lookups else None,
+            'avg_hit_ms': stats['hit_time'] * 1000 / stats['hits'] if stats['hits'] else None,
+            'avg_miss_ms': stats['miss_time'] * 1000 / stats['misses'] if stats['misses'] else None,
+            'default_ttl': self.default_ttl
+        }
+
+
+# Caché compartida por los endpoints de catálogo
+catalog_cache = CacheService('catalog', default_ttl=int(os.getenv('CATALOG_CACHE_TTL', 60)))
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+from flask import current_app
+
+from app import db
+from models.product import ProductCategory, ProductListing, Branch
+from services.cache_service import catalog_cache
+from utils.json_utils import dumps
+
+# Productos destacados y nuevos incluidos en la portada
+HOME_PRODUCTS_LIMIT = 8
+
+# Segundos máximos de vigencia de una portada (acota el desfase del stock,
+# que cambia sin incrementar la versión del catálogo)
+HOME_MAX_AGE = int(os.getenv('HOME_SNAPSHOT_TTL', 60))
+
+class HomeSnapshot:
+    """
+    Portada del catálogo precalculada y ya serializada
+
+    Cada worker guarda en memoria el cuerpo JSON de la última portada y lo
+    comparte con los demás mediante la caché del catálogo. Cuando cambia
+    la versión del catálogo (o vence la vigencia) se reconstruye en segundo
+    plano mientras se sigue sirviendo la anterior; sólo la primera
+    solicitud de un worker sin portada espera la construcción.
+    """
+
+    def __init__(self, max_age=HOME_MAX_AGE):
+        self.max_age = max_age
+        self._body = None
+        self._version = None
+        self._built_at = 0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Cuerpo JSON de la portada vigente
+
+        Returns:
+            bytes: Portada serializada
+        """
+        version = catalog_cache.get_version()
+        if self._is_fresh(version):
+            return self._body
+
+        # Otro worker pudo haberla construido para esta versión (sin Redis
+        # no hay versión compartida y cada worker usa la propia)
+        body = catalog_cache.get(self._key(version)) if version is not None else None
+        if body is not None:
+            self._store(body, version)
+            return body
+
+        if self._body is None:
+            return self.rebuild()
+
+        self._rebuild_in_background()
+        return self._body
+
+    def rebuild(self):
+        """
+        Construir la portada y publicarla en la caché del catálogo
+
+        Returns:
+            bytes: Portada serializada
+        """
+        # La versión se lee antes de consultar: si cambia durante la
+        # construcción, la siguiente solicitud vuelve a reconstruir
+        version = catalog_cache.get_version()
+        body = dumps(self.build())
+        if version is not None:
+            catalog_cache.set(self._key(version), body, self.max_age)
+        self._store(body, version)
+        return body
+
+    def build(self):
+        """Datos de la portada: destacados, novedades, categorías y sucursales"""
+        featured = ProductListing.query.filter(
+            ProductListing.is_featured.is_(True)
+        ).order_by(
+            ProductListing.popularity.desc(), ProductListing.id.desc()
+        ).limit(HOME_PRODUCTS_LIMIT).all()
+
+        new_products = ProductListing.query.filter(
+            ProductListing.is_new.is_(True)
+        ).order_by(
+            ProductListing.created_at.desc(), ProductListing.id.desc()
+        ).limit(HOME_PRODUCTS_LIMIT).all()
+
+        branches = Branch.query.order_by(Branch.id).all()
+
+        return {
+            'featured_products': [product.to_dict() for product in featured],
+            'new_products': [product.to_dict() for product in new_products],
+            'categories': [{'id': cat.value, 'name': cat.value} for cat in ProductCategory],
+            'branches': [branch.to_dict() for branch in branches]
+        }
+
+    def _is_fresh(self, version):
+        return (
+            self._body is not None
+            and self._version == version
+            and time.monotonic() - self._built_at < self.max_age
+        )
+
+    @staticmethod
+    def _key(version):
+        return f"{catalog_cache.namespace}:home:v{version}"
+
+    def _store(self, body, version):
+        with self._lock:
+            self._body = body
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        """Reconstruir en un hilo aparte (a lo más una reconstrucción por worker)"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    self.rebuild()
+                except Exception as e:
+                    app.logger.error(f"Error al reconstruir la portada: {e}")
+                finally:
+                    db.session.remove()
+                    self._rebuilding = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+# Portada de este worker
+home_snapshot = HomeSnapshot()
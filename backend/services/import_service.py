@@ -0,0 +1,455 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from app import db
+from models.product import ProductCategory, Branch, MovementReason
+from services.stock_ledger_service import stock_ledger
+from utils.validation import validate_product_sku, validate_price
+
+# Largo máximo de las columnas de texto de productos
+TEXT_LIMITS = {
+    'sku': 50,
+    'name': 100,
+    'brand': 50,
+    'brand_code': 50,
+    'subcategory': 50,
+    'image_url': 255
+}
+
+# Precio máximo admitido por la columna NUMERIC(10, 2)
+MAX_PRICE = Decimal('99999999.99')
+
+# Columnas de la tabla temporal de productos (en el orden del COPY)
+STAGING_PRODUCT_COLUMNS = [
+    'sku', 'name', 'description', 'brand', 'brand_code', 'category',
+    'subcategory', 'price', 'discount_percentage', 'is_featured', 'is_new', 'image_url'
+]
+
+# Columnas de la tabla temporal de stock
+STAGING_STOCK_COLUMNS = ['sku', 'branch_id', 'quantity', 'min_stock']
+
+# Upsert de productos y su historial de precios en una sola sentencia:
+# actualiza los SKU existentes, inserta los nuevos y registra un precio
+# para cada producto nuevo o cuyo precio cambió
+UPSERT_PRODUCTS_SQL = """
+WITH previous AS (
+    SELECT p.id, p.price
+    FROM products p
+    JOIN product_import_staging s ON s.sku = p.sku
+),
+updated AS (
+    UPDATE products p SET
+        name = s.name,
+        description = COALESCE(s.description, p.description),
+        brand = COALESCE(s.brand, p.brand),
+        brand_code = COALESCE(s.brand_code, p.brand_code),
+        category = s.category::productcategory,
+        subcategory = COALESCE(s.subcategory, p.subcategory),
+        price = s.price,
+        discount_percentage = COALESCE(s.discount_percentage, p.discount_percentage),
+        is_featured = COALESCE(s.is_featured, p.is_featured),
+        is_new = COALESCE(s.is_new, p.is_new),
+        image_url = COALESCE(s.image_url, p.image_url),
+        updated_at = now() AT TIME ZONE 'utc'
+    FROM product_import_staging s
+    WHERE p.sku = s.sku
+    RETURNING p.id, p.price
+),
+inserted AS (
+    INSERT INTO products (
+        sku, name, description, brand, brand_code, category, subcategory, price,
+        discount_percentage, is_featured, is_new, image_url, popularity, created_at, updated_at
+    )
+    SELECT
+        s.sku, s.name, s.description, s.brand, s.brand_code, s.category::productcategory,
+        s.subcategory, s.price, COALESCE(s.discount_percentage, 0), COALESCE(s.is_featured, false),
+        COALESCE(s.is_new, true), s.image_url, 0, now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+    FROM product_import_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.sku = s.sku)
+    RETURNING id, price
+),
+history AS (
+    INSERT INTO price_history (product_id, price, created_at)
+    SELECT i.id, i.price, now() AT TIME ZONE 'utc' FROM inserted i
+    UNION ALL
+    SELECT u.id, u.price, now() AT TIME ZONE 'utc'
+    FROM updated u
+    JOIN previous pr ON pr.id = u.id
+    WHERE pr.price <> u.price
+    RETURNING 1
+)
+SELECT
+    (SELECT COUNT(*) FROM inserted),
+    (SELECT COUNT(*) FROM updated),
+    (SELECT COUNT(*) FROM history)
+"""
+
+# Stock por sucursal: actualizar los registros existentes e insertar los faltantes
+UPDATE_STOCKS_SQL = """
+UPDATE stocks st SET
+    quantity = ss.quantity,
+    min_stock = COALESCE(ss.min_stock, st.min_stock),
+    updated_at = now() AT TIME ZONE 'utc'
+FROM stock_import_staging ss
+JOIN products p ON p.sku = ss.sku
+WHERE st.product_id = p.id AND st.branch_id = ss.branch_id
+"""
+
+INSERT_STOCKS_SQL = """
+INSERT INTO stocks (product_id, branch_id, quantity, min_stock, updated_at)
+SELECT p.id, ss.branch_id, ss.quantity, COALESCE(ss.min_stock, 5), now() AT TIME ZONE 'utc'
+FROM stock_import_staging ss
+JOIN products p ON p.sku = ss.sku
+ON CONFLICT (product_id, branch_id) DO NOTHING
+"""
+
+class ProductImportService:
+    """Servicio para importar catálogos de productos en lote"""
+
+    def __init__(self, batch_size=5000, max_reported_errors=1000):
+        """
+        Inicializar servicio de importación
+
+        Args:
+            batch_size: Filas válidas por lote (una transacción por lote)
+            max_reported_errors: Máximo de errores detallados en el resumen
+        """
+        self.batch_size = batch_size
+        self.max_reported_errors = max_reported_errors
+
+    def import_stream(self, stream, file_format='csv'):
+        """
+        Importar productos desde un flujo CSV o NDJSON
+
+        Las filas inválidas se reportan y se omiten sin abortar la
+        importación; las válidas se cargan por lotes con COPY a tablas
+        temporales y se aplican con sentencias sobre conjuntos.
+
+        Args:
+            stream: Flujo binario o de texto con el contenido
+            file_format: 'csv' o 'ndjson'
+
+        Returns:
+            dict: Resumen con totales y errores por fila
+        """
+        if file_format not in ('csv', 'ndjson'):
+            raise ValueError("Formato inválido")
+
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding='utf-8-sig')
+
+        summary = {
+            'total': 0,
+            'inserted': 0,
+            'updated': 0,
+            'price_changes': 0,
+            'failed': 0,
+            'errors': []
+        }
+
+        branch_ids = {branch_id for (branch_id,) in db.session.query(Branch.id).all()}
+        batch = []
+        batch_skus = set()
+
+        for row_number, row, parse_error in self.parse_rows(stream, file_format):
+            summary['total'] += 1
+
+            if parse_error:
+                self._add_error(summary, row_number, None, [parse_error])
+                continue
+
+            product, stocks, errors = self.validate_row(row, branch_ids)
+            if not errors and product['sku'] in batch_skus:
+                errors = ["SKU repetido en el mismo lote"]
+            if errors:
+                self._add_error(summary, row_number, row.get('sku'), errors)
+                continue
+
+            batch.append((row_number, product, stocks))
+            batch_skus.add(product['sku'])
+
+            if len(batch) >= self.batch_size:
+                self._flush_batch(batch, summary)
+                batch = []
+                batch_skus = set()
+
+        if batch:
+            self._flush_batch(batch, summary)
+
+        return summary
+
+    def parse_rows(self, stream, file_format):
+        """
+        Recorrer las filas del archivo sin cargarlo completo en memoria
+
+        Yields:
+            tuple: (número de fila, diccionario de la fila, error de lectura o None)
+        """
+        if file_format == 'csv':
+            for row_number, row in enumerate(csv.DictReader(stream), start=1):
+                yield row_number, row, None
+            return
+
+        row_number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield row_number, None, "JSON inválido"
+                continue
+            if not isinstance(row, dict):
+                yield row_number, None, "Se esperaba un objeto JSON"
+                continue
+            yield row_number, row, None
+
+    def validate_row(self, row, branch_ids):
+        """
+        Validar y normalizar una fila de producto
+
+        Args:
+            row: Diccionario leído del archivo
+            branch_ids: IDs de sucursales existentes
+
+        Returns:
+            tuple: (producto normalizado, lista de stock, lista de errores)
+        """
+        errors = []
+
+        def text(field):
+            value = row.get(field)
+            if value is None:
+                return None
+            value = str(value).strip()
+            if not value:
+                return None
+            if '\x00' in value:
+                errors.append(f"{field} contiene caracteres inválidos")
+            if field in TEXT_LIMITS and len(value) > TEXT_LIMITS[field]:
+                errors.append(f"{field} supera {TEXT_LIMITS[field]} caracteres")
+            return value
+
+        def boolean(field):
+            value = row.get(field)
+            if value is None or value == '':
+                return None
+            if isinstance(value, bool):
+                return value
+            value = str(value).strip().lower()
+            if value in ('true', '1', 'si', 'sí', 'yes'):
+                return True
+            if value in ('false', '0', 'no'):
+                return False
+            errors.append(f"{field} debe ser verdadero o falso")
+            return None
+
+        product = {field: text(field) for field in (
+            'sku', 'name', 'description', 'brand', 'brand_code', 'subcategory', 'image_url'
+        )}
+        product['is_featured'] = boolean('is_featured')
+        product['is_new'] = boolean('is_new')
+
+        if not product['sku'] or not validate_product_sku(product['sku']):
+            errors.append("SKU inválido")
+
+        if not product['name']:
+            errors.append("Falta el nombre")
+
+        price = row.get('price')
+        if not validate_price(price):
+            errors.append("Precio inválido")
+        else:
+            try:
+                product['price'] = Decimal(str(price)).quantize(Decimal('0.01'))
+            except InvalidOperation:
+                errors.append("Precio inválido")
+            else:
+                if product['price'] > MAX_PRICE:
+                    errors.append("Precio fuera de rango")
+
+        # Categoría por nombre (POWER_TOOLS) o por valor (Herramientas Eléctricas)
+        category = text('category')
+        product['category'] = None
+        for member in ProductCategory:
+            if category in (member.name, member.value):
+                product['category'] = member.name
+                break
+        else:
+            errors.append("Categoría inválida")
+
+        discount = row.get('discount_percentage')
+        product['discount_percentage'] = None
+        if discount not in (None, ''):
+            try:
+                product['discount_percentage'] = int(discount)
+            except (ValueError, TypeError):
+                errors.append("Descuento inválido")
+            else:
+                if not 0 <= product['discount_percentage'] <= 100:
+                    errors.append("Descuento fuera de rango")
+
+        stocks = self._parse_stocks(row.get('stocks'), branch_ids, errors)
+        return product, stocks, errors
+
+    def _parse_stocks(self, value, branch_ids, errors):
+        """
+        Normalizar el stock por sucursal de una fila
+
+        Acepta una lista de objetos {branch_id, quantity, min_stock} (NDJSON)
+        o un texto "branch_id:cantidad[:mínimo];..." (CSV).
+        """
+        if value in (None, ''):
+            return []
+
+        if isinstance(value, str):
+            entries = []
+            for part in value.split(';'):
+                if not part.strip():
+                    continue
+                fields = part.split(':')
+                entries.append({
+                    'branch_id': fields[0],
+                    'quantity': fields[1] if len(fields) > 1 else None,
+                    'min_stock': fields[2] if len(fields) > 2 else None
+                })
+        elif isinstance(value, list):
+            entries = value
+        else:
+            errors.append("Formato de stock inválido")
+            return []
+
+        stocks = []
+        seen = set()
+        for entry in entries:
+            try:
+                branch_id = int(entry['branch_id'])
+                quantity = int(entry['quantity'])
+                min_stock = entry.get('min_stock')
+                min_stock = int(min_stock) if min_stock not in (None, '') else None
+            except (KeyError, ValueError, TypeError, AttributeError):
+                errors.append("Formato de stock inválido")
+                return []
+
+            if branch_id not in branch_ids:
+                errors.append(f"Sucursal {branch_id} no existe")
+            elif branch_id in seen:
+                errors.append(f"Sucursal {branch_id} repetida")
+            elif quantity < 0 or (min_stock is not None and min_stock < 0):
+                errors.append("Las cantidades de stock no pueden ser negativas")
+            else:
+                seen.add(branch_id)
+                stocks.append((branch_id, quantity, min_stock))
+
+        return stocks
+
+    def _flush_batch(self, batch, summary):
+        """
+        Cargar un lote de filas válidas en una transacción
+
+        Si la base de datos rechaza el lote, se reintenta en dos mitades
+        (cada una en su transacción) hasta aislar las filas que fallan:
+        sólo esas se reportan y el resto del lote se carga.
+        """
+        try:
+            inserted, updated, price_changes = self._load_batch(batch)
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                row_number, product, _ = batch[0]
+                self._add_error(summary, row_number, product['sku'], [f"Error al guardar la fila: {e}"])
+                return
+            middle = len(batch) // 2
+            self._flush_batch(batch[:middle], summary)
+            self._flush_batch(batch[middle:], summary)
+            return
+
+        summary['inserted'] += inserted
+        summary['updated'] += updated
+        summary['price_changes'] += price_changes
+
+    def _load_batch(self, batch):
+        """
+        Copiar un lote a las tablas temporales y aplicarlo con sentencias sobre conjuntos
+
+        Returns:
+            tuple: (productos creados, actualizados, cambios de precio)
+        """
+        stock_ledger.set_context(MovementReason.IMPORT)
+        connection = db.session.connection()
+        cursor = connection.connection.cursor()
+
+        cursor.execute("""
+            CREATE TEMP TABLE product_import_staging (
+                sku VARCHAR(50) PRIMARY KEY,
+                name VARCHAR(100),
+                description TEXT,
+                brand VARCHAR(50),
+                brand_code VARCHAR(50),
+                category TEXT,
+                subcategory VARCHAR(50),
+                price NUMERIC(10, 2),
+                discount_percentage INTEGER,
+                is_featured BOOLEAN,
+                is_new BOOLEAN,
+                image_url VARCHAR(255)
+            ) ON COMMIT DROP
+        """)
+        cursor.execute("""
+            CREATE TEMP TABLE stock_import_staging (
+                sku VARCHAR(50),
+                branch_id INTEGER,
+                quantity INTEGER,
+                min_stock INTEGER
+            ) ON COMMIT DROP
+        """)
+
+        products_buffer = io.StringIO()
+        stocks_buffer = io.StringIO()
+        products_writer = csv.writer(products_buffer)
+        stocks_writer = csv.writer(stocks_buffer)
+
+        for _, product, stocks in batch:
+            products_writer.writerow([self._copy_value(product[c]) for c in STAGING_PRODUCT_COLUMNS])
+            for branch_id, quantity, min_stock in stocks:
+                stocks_writer.writerow([product['sku'], branch_id, quantity, self._copy_value(min_stock)])
+
+        products_buffer.seek(0)
+        stocks_buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY product_import_staging ({', '.join(STAGING_PRODUCT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            products_buffer
+        )
+        cursor.copy_expert(
+            f"COPY stock_import_staging ({', '.join(STAGING_STOCK_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            stocks_buffer
+        )
+
+        cursor.execute(UPSERT_PRODUCTS_SQL)
+        counts = cursor.fetchone()
+        cursor.execute(UPDATE_STOCKS_SQL)
+        cursor.execute(INSERT_STOCKS_SQL)
+
+        db.session.commit()
+        return counts
+
+    @staticmethod
+    def _copy_value(value):
+        """Representación de un valor para COPY en formato CSV (vacío = NULL)"""
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return value
+
+    def _add_error(self, summary, row_number, sku, errors):
+        summary['failed'] += 1
+        if len(summary['errors']) < self.max_reported_errors:
+            summary['errors'].append({
+                'row': row_number,
+                'sku': sku,
+                'errors': errors
+            })
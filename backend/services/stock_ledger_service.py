@@ -0,0 +1,172 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import db
+from models.product import MovementReason
+
+# Meses siguientes al actual con partición del registro de movimientos ya creada
+PARTITION_MONTHS_AHEAD = 3
+
+# Meses con filas en la partición por defecto (les faltó su partición)
+DEFAULT_PARTITION_MONTHS_SQL = """
+SELECT DISTINCT date_trunc('month', created_at)::date AS month
+FROM stock_movements_default
+ORDER BY month
+"""
+
+# Variables de la transacción leídas por el trigger stocks_log_movement
+SET_CONTEXT_SQL = """
+SELECT
+    set_config('ferremas.stock_reason', :reason, true),
+    set_config('ferremas.stock_actor', :actor, true),
+    set_config('ferremas.stock_order', :order_id, true),
+    set_config('ferremas.stock_reference', :reference, true)
+"""
+
+# Cierre de todas las sucursales a una fecha: cierre anterior más los
+# movimientos posteriores a él (el registro ya tiene el punto de partida)
+TAKE_SNAPSHOTS_SQL = """
+WITH previous AS (
+    SELECT DISTINCT ON (branch_id) branch_id, taken_at
+    FROM stock_snapshots
+    WHERE taken_at < :until
+    ORDER BY branch_id, taken_at DESC
+)
+INSERT INTO stock_snapshots (branch_id, taken_at, product_id, quantity)
+SELECT b.id, :until, x.product_id, sum(x.quantity)
+FROM branches b
+LEFT JOIN previous p ON p.branch_id = b.id
+JOIN LATERAL (
+    SELECT s.product_id, s.quantity
+    FROM stock_snapshots s
+    WHERE s.branch_id = b.id AND s.taken_at = p.taken_at
+    UNION ALL
+    SELECT m.product_id, m.delta
+    FROM stock_movements m
+    WHERE m.branch_id = b.id
+      AND m.created_at > coalesce(p.taken_at, '-infinity')
+      AND m.created_at <= :until
+) x ON true
+WHERE NOT EXISTS (
+    SELECT 1 FROM stock_snapshots done WHERE done.branch_id = b.id AND done.taken_at = :until
+)
+GROUP BY b.id, x.product_id
+"""
+
+# Stock de una sucursal a una fecha: último cierre anterior más los movimientos siguientes
+STOCK_AS_OF_SQL = """
+WITH base AS (
+    SELECT max(taken_at) AS taken_at
+    FROM stock_snapshots
+    WHERE branch_id = :branch_id AND taken_at <= :at
+)
+SELECT x.product_id, sum(x.quantity) AS quantity, max(base.taken_at) AS snapshot_at
+FROM base, (
+    SELECT s.product_id, s.quantity
+    FROM stock_snapshots s, base
+    WHERE s.branch_id = :branch_id AND s.taken_at = base.taken_at
+    UNION ALL
+    SELECT m.product_id, m.delta
+    FROM stock_movements m, base
+    WHERE m.branch_id = :branch_id
+      AND m.created_at > coalesce(base.taken_at, '-infinity')
+      AND m.created_at <= :at
+) x
+GROUP BY x.product_id
+ORDER BY x.product_id
+"""
+
+class StockLedgerService:
+    """
+    Registro de movimientos de stock y cierres periódicos por sucursal
+
+    Cada cambio de stocks.quantity deja un movimiento escrito por trigger
+    en la misma transacción; este servicio fija el motivo y las
+    referencias de esos movimientos, mantiene las particiones mensuales y
+    calcula cierres para responder "stock a la fecha" desde el cierre
+    anterior más los movimientos posteriores.
+    """
+
+    def set_context(self, reason, actor_id=None, order_id=None, reference=None):
+        """
+        Fijar motivo y referencias de los movimientos de la transacción actual
+
+        Debe llamarse antes de modificar stock y vale hasta el commit.
+
+        Args:
+            reason: MovementReason del cambio
+            actor_id: ID del usuario que realiza el cambio
+            order_id: ID del pedido relacionado
+            reference: Referencia libre (p. ej. de una transferencia)
+        """
+        actor = str(actor_id) if actor_id is not None and str(actor_id).isdigit() else ''
+        db.session.execute(text(SET_CONTEXT_SQL), {
+            'reason': reason.value if isinstance(reason, MovementReason) else reason,
+            'actor': actor,
+            'order_id': str(order_id) if order_id is not None else '',
+            'reference': (reference or '')[:50]
+        })
+
+    def ensure_partitions(self, months_ahead=PARTITION_MONTHS_AHEAD):
+        """
+        Crear las particiones mensuales del mes actual y los siguientes
+
+        También crea las de los meses con filas en la partición por
+        defecto; create_stock_movement_partition traslada esas filas a la
+        partición nueva.
+
+        Args:
+            months_ahead: Meses siguientes al actual con partición
+        """
+        months = db.session.execute(text(DEFAULT_PARTITION_MONTHS_SQL)).scalars().all()
+        for month in months:
+            db.session.execute(text("SELECT create_stock_movement_partition(:month)"), {'month': month})
+
+        for month in range(months_ahead + 1):
+            db.session.execute(
+                text("SELECT create_stock_movement_partition((now() + make_interval(months => :month))::date)"),
+                {'month': month}
+            )
+        db.session.commit()
+
+    def take_snapshots(self, until=None):
+        """
+        Registrar el cierre de todas las sucursales a una fecha
+
+        La fecha debe quedar en el pasado (por defecto, el inicio del día
+        UTC actual) para que no falten movimientos de transacciones en curso.
+
+        Args:
+            until: Fecha y hora del cierre
+
+        Returns:
+            int: Filas de cierre registradas (0 si ya existía)
+        """
+        if until is None:
+            until = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        result = db.session.execute(text(TAKE_SNAPSHOTS_SQL), {'until': until})
+        db.session.commit()
+        return result.rowcount
+
+    def stock_as_of(self, branch_id, at):
+        """
+        Stock de cada producto de una sucursal a una fecha
+
+        Args:
+            branch_id: ID de la sucursal
+            at: Fecha y hora de la consulta
+
+        Returns:
+            tuple: (lista de {product_id, quantity}, fecha del cierre usado o None)
+        """
+        rows = db.session.execute(text(STOCK_AS_OF_SQL), {'branch_id': branch_id, 'at': at}).fetchall()
+        snapshot_at = rows[0].snapshot_at if rows else None
+        return [
+            {'product_id': row.product_id, 'quantity': int(row.quantity)} for row in rows
+        ], snapshot_at
+
+
+# Servicio compartido por los endpoints de stock y pedidos
+stock_ledger = StockLedgerService()
@@ -0,0 +1,458 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app import db
+from models.order import Order, OrderStatus
+from services.cache_service import catalog_cache, STOCK_VERSION
+
+# Segundos que un pedido pendiente mantiene su reserva antes de vencer
+RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', 3600))
+
+# Pedidos con reserva vencida procesados por cada pasada del barrido
+EXPIRE_BATCH_SIZE = 100
+
+# Orden de bloqueo de todas las escrituras de stock: sólo los registros
+# (branch_id, product_id) afectados, siempre en orden ascendente. Pedidos
+# de otra sucursal u otros productos no esperan; los triggers del modelo de
+# lectura (product_listing) bloquean sus filas por id al final de cada
+# sentencia, de modo que dos escrituras concurrentes nunca se bloquean en
+# orden inverso.
+LOCK_STOCKS_SQL = """
+SELECT st.id FROM stocks st
+JOIN unnest(CAST(:branch_ids AS integer[]), CAST(:product_ids AS integer[])) AS line(branch_id, product_id)
+  ON st.branch_id = line.branch_id AND st.product_id = line.product_id
+ORDER BY st.branch_id, st.product_id
+FOR NO KEY UPDATE OF st
+"""
+
+# Reserva condicional: sólo se reservan las líneas con stock disponible
+# (quantity - reserved) suficiente, y cada una deja su fila de reserva
+RESERVE_STOCK_SQL = """
+WITH reserved AS (
+    UPDATE stocks st SET
+        reserved = st.reserved + line.quantity,
+        updated_at = now() AT TIME ZONE 'utc'
+    FROM unnest(CAST(:product_ids AS integer[]), CAST(:quantities AS integer[])) AS line(product_id, quantity)
+    WHERE st.branch_id = :branch_id
+      AND st.product_id = line.product_id
+      AND st.quantity - st.reserved >= line.quantity
+    RETURNING st.product_id, line.quantity
+)
+INSERT INTO stock_reservations (order_id, product_id, branch_id, quantity, expires_at, created_at)
+SELECT :order_id, product_id, :branch_id, quantity, CAST(:expires_at AS timestamp), now() AT TIME ZONE 'utc'
+FROM reserved
+RETURNING product_id
+"""
+
+CONFIRM_RESERVATION_SQL = """
+UPDATE stock_reservations SET expires_at = NULL
+WHERE order_id = :order_id AND expires_at IS NOT NULL
+"""
+
+# Liberación: borra las reservas del pedido y descuenta el contador
+RELEASE_RESERVATION_SQL = """
+WITH released AS (
+    DELETE FROM stock_reservations WHERE order_id = :order_id
+    RETURNING product_id, branch_id, quantity
+),
+totals AS (
+    SELECT product_id, branch_id, sum(quantity) AS quantity
+    FROM released
+    GROUP BY product_id, branch_id
+)
+UPDATE stocks st SET
+    reserved = greatest(st.reserved - totals.quantity, 0),
+    updated_at = now() AT TIME ZONE 'utc'
+FROM totals
+WHERE st.product_id = totals.product_id AND st.branch_id = totals.branch_id
+"""
+
+# Entrega: descuenta las unidades y libera lo reservado en la misma sentencia.
+# Cada línea exige stock disponible más lo reservado por el propio pedido:
+# un pedido sin reserva (anterior a las reservas, o cancelado por
+# vencimiento y luego entregado) no puede dejar el stock negativo
+CONSUME_STOCK_SQL = """
+WITH released AS (
+    DELETE FROM stock_reservations WHERE order_id = :order_id
+    RETURNING product_id, quantity
+),
+held AS (
+    SELECT product_id, sum(quantity) AS quantity
+    FROM released
+    GROUP BY product_id
+)
+UPDATE stocks st SET
+    quantity = st.quantity - line.quantity,
+    reserved = greatest(st.reserved - coalesce(held.quantity, 0), 0),
+    updated_at = now() AT TIME ZONE 'utc'
+FROM unnest(CAST(:product_ids AS integer[]), CAST(:quantities AS integer[])) AS line(product_id, quantity)
+LEFT JOIN held ON held.product_id = line.product_id
+WHERE st.branch_id = :branch_id
+  AND st.product_id = line.product_id
+  AND st.quantity - st.reserved + coalesce(held.quantity, 0) >= line.quantity
+RETURNING st.product_id, st.quantity, st.min_stock
+"""
+
+RESERVED_PRODUCTS_SQL = """
+SELECT DISTINCT product_id FROM stock_reservations WHERE order_id = :order_id
+"""
+
+# Ajuste masivo (p. ej. toma de inventario): bloqueo de los registros
+# con los nombres para las alertas, y una sola sentencia para todas las líneas
+LOCK_STOCK_ROWS_SQL = """
+SELECT st.id, st.product_id, st.branch_id, st.quantity,
+       p.name AS product_name, b.name AS branch_name
+FROM stocks st
+JOIN products p ON p.id = st.product_id
+JOIN branches b ON b.id = st.branch_id
+WHERE st.id = ANY(CAST(:stock_ids AS integer[]))
+ORDER BY st.branch_id, st.product_id
+FOR NO KEY UPDATE OF st
+"""
+
+SET_STOCK_QUANTITIES_SQL = """
+UPDATE stocks st SET
+    quantity = line.quantity,
+    min_stock = coalesce(line.min_stock, st.min_stock),
+    updated_at = now() AT TIME ZONE 'utc'
+FROM unnest(
+    CAST(:stock_ids AS integer[]), CAST(:quantities AS integer[]), CAST(:min_stocks AS integer[])
+) AS line(id, quantity, min_stock)
+WHERE st.id = line.id
+RETURNING st.id, st.quantity, st.min_stock
+"""
+
+# Inicialización de stock de productos por sucursal (un producto en todas
+# las sucursales o todos los productos en una) con una sola sentencia; la
+# restricción única (product_id, branch_id) resuelve crear o actualizar
+INITIALIZE_STOCKS_SQL = """
+WITH previous AS (
+    SELECT product_id, branch_id, quantity
+    FROM stocks
+    WHERE (CAST(:product_id AS integer) IS NULL OR product_id = :product_id)
+      AND (CAST(:branch_id AS integer) IS NULL OR branch_id = :branch_id)
+),
+upserted AS (
+    INSERT INTO stocks (product_id, branch_id, quantity, min_stock, updated_at)
+    SELECT p.id, b.id, :quantity, coalesce(CAST(:min_stock AS integer), 5), now() AT TIME ZONE 'utc'
+    FROM products p
+    CROSS JOIN branches b
+    WHERE (CAST(:product_id AS integer) IS NULL OR p.id = :product_id)
+      AND (CAST(:branch_id AS integer) IS NULL OR b.id = :branch_id)
+    ORDER BY b.id, p.id
+    ON CONFLICT (product_id, branch_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        min_stock = coalesce(CAST(:min_stock AS integer), stocks.min_stock),
+        updated_at = EXCLUDED.updated_at
+    RETURNING product_id, branch_id, quantity
+)
+SELECT u.product_id, u.branch_id, b.name AS branch_name, u.quantity,
+       prev.quantity AS old_quantity, prev.product_id IS NULL AS created
+FROM upserted u
+JOIN branches b ON b.id = u.branch_id
+LEFT JOIN previous prev ON prev.product_id = u.product_id AND prev.branch_id = u.branch_id
+ORDER BY u.branch_id, u.product_id
+"""
+
+# Transferencia: salida condicionada al stock disponible y entrada que crea
+# el registro de destino si no existe
+TRANSFER_OUT_SQL = """
+UPDATE stocks SET
+    quantity = quantity - :quantity,
+    updated_at = now() AT TIME ZONE 'utc'
+WHERE product_id = :product_id
+  AND branch_id = :branch_id
+  AND quantity - reserved >= :quantity
+RETURNING quantity, min_stock
+"""
+
+TRANSFER_IN_SQL = """
+INSERT INTO stocks (product_id, branch_id, quantity, min_stock, updated_at)
+VALUES (:product_id, :branch_id, :quantity, :min_stock, now() AT TIME ZONE 'utc')
+ON CONFLICT (product_id, branch_id) DO UPDATE SET
+    quantity = coalesce(stocks.quantity, 0) + EXCLUDED.quantity,
+    updated_at = EXCLUDED.updated_at
+RETURNING quantity
+"""
+
+EXPIRED_ORDERS_SQL = """
+SELECT DISTINCT order_id FROM stock_reservations
+WHERE expires_at < now() AT TIME ZONE 'utc'
+LIMIT :limit
+"""
+
+class InsufficientStockError(Exception):
+    """Stock insuficiente en la sucursal para una o más líneas del pedido"""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Stock insuficiente para los productos {product_ids}")
+
+class StockService:
+    """
+    Reservas y movimientos de stock de pedidos sin lecturas previas
+
+    Un pedido reserva su stock al crearse (con vencimiento mientras está
+    pendiente), lo libera al rechazarse o cancelarse y lo descuenta al
+    entregarse. Cada operación aplica todas las líneas con una sola
+    sentencia; la condición quantity - reserved >= cantidad evita reservar
+    más de lo disponible sin verificar con un SELECT previo. Los cambios
+    quedan en la transacción actual: el llamador confirma o revierte.
+    """
+
+    @staticmethod
+    def group_lines(lines):
+        """
+        Suma las cantidades por producto
+
+        Args:
+            lines: Iterable de tuplas (product_id, cantidad)
+
+        Returns:
+            dict: Cantidad total por product_id, ordenado por id
+        """
+        quantities = {}
+        for product_id, quantity in lines:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return dict(sorted(quantities.items()))
+
+    def lock(self, keys):
+        """
+        Bloquear registros de stock en el orden común de escritura
+
+        Args:
+            keys: Iterable de tuplas (branch_id, product_id)
+        """
+        keys = sorted(set(keys))
+        db.session.execute(text(LOCK_STOCKS_SQL), {
+            'branch_ids': [branch_id for branch_id, _ in keys],
+            'product_ids': [product_id for _, product_id in keys]
+        })
+
+    def reserve(self, order_id, branch_id, quantities, ttl=RESERVATION_TTL):
+        """
+        Reservar stock de una sucursal para todas las líneas de un pedido
+
+        Args:
+            order_id: ID del pedido
+            branch_id: ID de la sucursal
+            quantities: Cantidad por product_id (ver group_lines)
+            ttl: Segundos de vigencia de la reserva (None para no vencer)
+
+        Raises:
+            InsufficientStockError: Si alguna línea no tiene stock disponible;
+                la transacción debe revertirse
+        """
+        if not quantities:
+            return
+
+        product_ids = sorted(quantities)
+        self.lock((branch_id, product_id) for product_id in product_ids)
+
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl) if ttl is not None else None
+        rows = db.session.execute(text(RESERVE_STOCK_SQL), {
+            'order_id': order_id,
+            'branch_id': branch_id,
+            'product_ids': product_ids,
+            'quantities': [quantities[product_id] for product_id in product_ids],
+            'expires_at': expires_at
+        }).fetchall()
+
+        if len(rows) < len(product_ids):
+            reserved = {row.product_id for row in rows}
+            raise InsufficientStockError([pid for pid in product_ids if pid not in reserved])
+
+    def confirm(self, order_id):
+        """Quitar el vencimiento de las reservas de un pedido aprobado"""
+        db.session.execute(text(CONFIRM_RESERVATION_SQL), {'order_id': order_id})
+
+    def release(self, order_id, branch_id):
+        """
+        Liberar las reservas de un pedido rechazado, cancelado o vencido
+
+        Args:
+            order_id: ID del pedido
+            branch_id: ID de la sucursal del pedido
+        """
+        product_ids = [row.product_id for row in db.session.execute(
+            text(RESERVED_PRODUCTS_SQL), {'order_id': order_id}
+        )]
+        if not product_ids:
+            return
+
+        self.lock((branch_id, product_id) for product_id in product_ids)
+        db.session.execute(text(RELEASE_RESERVATION_SQL), {'order_id': order_id})
+
+    def consume(self, order_id, branch_id, quantities):
+        """
+        Descontar el stock de un pedido entregado y liberar su reserva
+
+        Args:
+            order_id: ID del pedido
+            branch_id: ID de la sucursal
+            quantities: Cantidad por product_id (ver group_lines)
+
+        Returns:
+            list: Filas (product_id, quantity, min_stock) con el stock resultante
+
+        Raises:
+            InsufficientStockError: Si alguna línea no tiene registro de stock
+                o unidades suficientes; la transacción debe revertirse
+        """
+        if not quantities:
+            return []
+
+        product_ids = sorted(quantities)
+        self.lock((branch_id, product_id) for product_id in product_ids)
+
+        rows = db.session.execute(text(CONSUME_STOCK_SQL), {
+            'order_id': order_id,
+            'branch_id': branch_id,
+            'product_ids': product_ids,
+            'quantities': [quantities[product_id] for product_id in product_ids]
+        }).fetchall()
+
+        if len(rows) < len(product_ids):
+            consumed = {row.product_id for row in rows}
+            raise InsufficientStockError([pid for pid in product_ids if pid not in consumed])
+        return rows
+
+    def set_quantities(self, updates):
+        """
+        Fijar la cantidad de varios registros de stock con una sola sentencia
+
+        Args:
+            updates: Tupla (cantidad, stock mínimo o None) por stock_id
+
+        Returns:
+            dict: Por stock_id encontrado, product_id, branch_id, nombres de
+                producto y sucursal, cantidad anterior, nueva y stock mínimo
+        """
+        if not updates:
+            return {}
+
+        stock_ids = list(updates)
+        locked = db.session.execute(text(LOCK_STOCK_ROWS_SQL), {'stock_ids': stock_ids}).fetchall()
+        found = [row.id for row in locked]
+        if not found:
+            return {}
+
+        rows = db.session.execute(text(SET_STOCK_QUANTITIES_SQL), {
+            'stock_ids': found,
+            'quantities': [updates[stock_id][0] for stock_id in found],
+            'min_stocks': [updates[stock_id][1] for stock_id in found]
+        }).fetchall()
+        updated = {row.id: row for row in rows}
+
+        return {
+            row.id: {
+                'product_id': row.product_id,
+                'product_name': row.product_name,
+                'branch_id': row.branch_id,
+                'branch_name': row.branch_name,
+                'old_quantity': row.quantity,
+                'new_quantity': updated[row.id].quantity,
+                'min_stock': updated[row.id].min_stock
+            } for row in locked
+        }
+
+    def initialize(self, quantity, min_stock=None, product_id=None, branch_id=None):
+        """
+        Fijar el stock de un producto en todas las sucursales, de todos los
+        productos en una sucursal o de ambos, creando los registros faltantes
+
+        Args:
+            quantity: Cantidad inicial
+            min_stock: Stock mínimo (None conserva el actual; 5 al crear)
+            product_id: Producto a inicializar (None para todos)
+            branch_id: Sucursal a inicializar (None para todas)
+
+        Returns:
+            list: Filas (product_id, branch_id, branch_name, quantity,
+                old_quantity, created) por registro de stock
+        """
+        return db.session.execute(text(INITIALIZE_STOCKS_SQL), {
+            'quantity': quantity,
+            'min_stock': min_stock,
+            'product_id': product_id,
+            'branch_id': branch_id
+        }).fetchall()
+
+    def transfer(self, product_id, source_branch_id, target_branch_id, quantity):
+        """
+        Mover unidades disponibles de un producto entre sucursales
+
+        Args:
+            product_id: ID del producto
+            source_branch_id: Sucursal de origen
+            target_branch_id: Sucursal de destino (se crea su registro si falta)
+            quantity: Unidades a transferir
+
+        Returns:
+            tuple: (fila (quantity, min_stock) del origen, cantidad del destino),
+                o None si el origen no tiene stock disponible suficiente
+        """
+        # Bloquear ambos registros en el orden común: las transferencias
+        # del mismo producto en sentidos opuestos no se bloquean en orden
+        # inverso (el destino inexistente lo serializa la restricción única)
+        self.lock([(source_branch_id, product_id), (target_branch_id, product_id)])
+
+        source = db.session.execute(text(TRANSFER_OUT_SQL), {
+            'product_id': product_id,
+            'branch_id': source_branch_id,
+            'quantity': quantity
+        }).fetchone()
+        if source is None:
+            return None
+
+        target_quantity = db.session.execute(text(TRANSFER_IN_SQL), {
+            'product_id': product_id,
+            'branch_id': target_branch_id,
+            'quantity': quantity,
+            'min_stock': source.min_stock
+        }).scalar()
+        return source, target_quantity
+
+    def expire_reservations(self, limit=EXPIRE_BATCH_SIZE):
+        """
+        Cancelar los pedidos pendientes cuya reserva venció
+
+        Cada pedido se procesa en su propia transacción. Los pedidos que
+        otra transacción está modificando se omiten y quedan para la
+        siguiente pasada.
+
+        Returns:
+            int: Cantidad de pedidos cancelados
+        """
+        order_ids = [row.order_id for row in db.session.execute(
+            text(EXPIRED_ORDERS_SQL), {'limit': limit}
+        )]
+        db.session.commit()
+
+        expired = 0
+        for order_id in order_ids:
+            order = Order.query.filter_by(id=order_id).with_for_update(skip_locked=True).first()
+            if order is None:
+                db.session.rollback()
+                continue
+
+            if order.status == OrderStatus.PENDING:
+                self.release(order.id, order.branch_id)
+                order.update_status(OrderStatus.CANCELLED, "Reserva de stock vencida")
+                expired += 1
+            elif order.status in (OrderStatus.REJECTED, OrderStatus.CANCELLED):
+                self.release(order.id, order.branch_id)
+            else:
+                # Aprobado mientras vencía: la reserva se mantiene
+                self.confirm(order.id)
+            db.session.commit()
+
+        if order_ids:
+            catalog_cache.bump_version(STOCK_VERSION)
+        return expired
+
+
+# Servicio compartido por los endpoints de pedidos
+stock_service = StockService()
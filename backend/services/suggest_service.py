@@ -0,0 +1,222 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import func
+
+from app import db
+from models.product import Product, ProductChange
+from utils.pagination import keyset_filter
+from utils.search_utils import normalize_text
+
+# Segundos entre revisiones del registro de cambios de productos
+SYNC_INTERVAL = 5
+
+# Cambios pendientes a partir de los cuales conviene reconstruir el índice
+MAX_INCREMENTAL_CHANGES = 2000
+
+# Entradas del índice revisadas como máximo por consulta
+MAX_SCANNED_ENTRIES = 5000
+
+def product_terms(name, brand, sku):
+    """Términos indexados de un producto: palabras de nombre y marca y el SKU completo"""
+    terms = set(re.findall(r'\w+', normalize_text(f"{name} {brand or ''}")))
+    if brand:
+        terms.add(normalize_text(brand))
+    if sku:
+        terms.add(normalize_text(sku))
+    return terms
+
+class SuggestionIndex:
+    """
+    Índice de prefijos en memoria para autocompletar productos
+
+    Cada worker mantiene una lista ordenada de (término, id de producto)
+    y responde sugerencias con búsqueda binaria, sin consultar la base de
+    datos. Un hilo en segundo plano, iniciado con el worker, construye el
+    índice y lo actualiza incrementalmente leyendo el registro de cambios
+    de productos; las consultas sólo leen memoria.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._products = {}
+        self._cursor = None
+        self._built = False
+        self._worker_pid = None
+        self._lock = threading.RLock()
+
+    def build(self):
+        """Construir el índice completo a partir de la tabla de productos"""
+        xmin = self._snapshot_xmin()
+        last_change = db.session.query(ProductChange.txid, ProductChange.id).filter(
+            ProductChange.txid < xmin
+        ).order_by(ProductChange.txid.desc(), ProductChange.id.desc()).first()
+
+        products = {}
+        entries = []
+        rows = db.session.query(
+            Product.id, Product.name, Product.sku, Product.brand, Product.popularity
+        ).all()
+
+        for row in rows:
+            product, terms = self._make_product(row)
+            products[row.id] = product
+            entries.extend((term, row.id) for term in terms)
+
+        entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._products = products
+            self._cursor = tuple(last_change) if last_change else (0, 0)
+            self._built = True
+
+    def sync(self):
+        """Aplicar al índice los cambios de productos registrados desde la última revisión"""
+        xmin = self._snapshot_xmin()
+        sort_keys = [(ProductChange.txid, False), (ProductChange.id, False)]
+
+        changes = db.session.query(
+            ProductChange.txid, ProductChange.id, ProductChange.product_id
+        ).filter(
+            ProductChange.entity == 'product',
+            ProductChange.txid < xmin,
+            keyset_filter(sort_keys, list(self._cursor))
+        ).order_by(ProductChange.txid, ProductChange.id).limit(MAX_INCREMENTAL_CHANGES + 1).all()
+
+        if len(changes) > MAX_INCREMENTAL_CHANGES:
+            self.build()
+            return
+
+        if not changes:
+            return
+
+        product_ids = {change.product_id for change in changes}
+        rows = db.session.query(
+            Product.id, Product.name, Product.sku, Product.brand, Product.popularity
+        ).filter(Product.id.in_(product_ids)).all()
+        current = {row.id: row for row in rows}
+
+        with self._lock:
+            for product_id in product_ids:
+                self._remove(product_id)
+                if product_id in current:
+                    product, terms = self._make_product(current[product_id])
+                    self._products[product_id] = product
+                    for term in terms:
+                        insort(self._entries, (term, product_id))
+            last = changes[-1]
+            self._cursor = (last.txid, last.id)
+
+    def start(self, app):
+        """
+        Iniciar el hilo que construye y sincroniza el índice (uno por proceso)
+
+        Se llama en cada solicitud; después de la primera sólo compara el
+        pid, de modo que cada worker (también tras un fork) inicia su hilo.
+
+        Args:
+            app: Aplicación Flask (el hilo usa su propio contexto)
+        """
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, args=(app,), daemon=True).start()
+
+    def _run(self, app):
+        """Construir el índice y luego sincronizarlo cada SYNC_INTERVAL segundos"""
+        while True:
+            with app.app_context():
+                try:
+                    if self._built:
+                        self.sync()
+                    else:
+                        self.build()
+                except Exception as e:
+                    app.logger.error(f"Error al actualizar el índice de sugerencias: {e}")
+                finally:
+                    db.session.remove()
+            time.sleep(SYNC_INTERVAL)
+
+    def suggest(self, query, limit=8):
+        """
+        Sugerencias de productos para un texto parcial
+
+        Todos los términos deben coincidir por prefijo con algún término
+        del producto; el último se busca en el índice ordenado.
+
+        Args:
+            query: Texto ingresado por el usuario
+            limit: Cantidad máxima de sugerencias
+
+        Returns:
+            list: Productos sugeridos, más populares primero
+        """
+        tokens = re.findall(r'[\w-]+', normalize_text(query))
+        if not tokens:
+            return []
+
+        prefix, others = tokens[-1], tokens[:-1]
+        matches = []
+        seen = set()
+
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            end = min(position + MAX_SCANNED_ENTRIES, len(self._entries))
+
+            for term, product_id in self._entries[position:end]:
+                if not term.startswith(prefix):
+                    break
+                if product_id in seen:
+                    continue
+                seen.add(product_id)
+
+                product = self._products[product_id]
+                if all(any(t.startswith(other) for t in product['terms']) for other in others):
+                    matches.append(product)
+
+        matches.sort(key=lambda p: (-p['popularity'], p['name']))
+        return [
+            {
+                'id': product['id'],
+                'name': product['name'],
+                'sku': product['sku'],
+                'brand': product['brand']
+            } for product in matches[:limit]
+        ]
+
+    def _remove(self, product_id):
+        """Quitar los términos de un producto del índice"""
+        product = self._products.pop(product_id, None)
+        if not product:
+            return
+        for term in product['terms']:
+            position = bisect_left(self._entries, (term, product_id))
+            if position < len(self._entries) and self._entries[position] == (term, product_id):
+                del self._entries[position]
+
+    @staticmethod
+    def _make_product(row):
+        terms = product_terms(row.name, row.brand, row.sku)
+        return {
+            'id': row.id,
+            'name': row.name,
+            'sku': row.sku,
+            'brand': row.brand,
+            'popularity': row.popularity or 0,
+            'terms': terms
+        }, terms
+
+    @staticmethod
+    def _snapshot_xmin():
+        return db.session.query(func.txid_snapshot_xmin(func.txid_current_snapshot())).scalar()
+
+
+# Índice de sugerencias de este worker
+suggestion_index = SuggestionIndex()
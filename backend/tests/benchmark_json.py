@@ -0,0 +1,83 @@
+"""
+Comparación de serialización JSON del listado de productos
+
+Mide una página del listado serializada como antes de orjson (to_dict con
+float/isoformat y json.dumps de la biblioteca estándar) y como ahora
+(tuplas de columnas con rows_to_dicts y utils.json_utils.dumps). No usa
+la base de datos:
+
+    python tests/benchmark_json.py [filas] [repeticiones]
+"""
+import enum
+import json
+import os
+import sys
+import timeit
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.json_utils import dumps, rows_to_dicts  # noqa: E402
+
+# Mismas claves que ProductListing.list_columns
+Column = namedtuple('Column', 'key')
+COLUMNS = [Column(key) for key in (
+    'id', 'sku', 'name', 'description', 'brand', 'brand_code', 'category',
+    'subcategory', 'price', 'current_price', 'discount_percentage',
+    'is_featured', 'is_new', 'image_url', 'created_at'
+)]
+
+
+class Category(enum.Enum):
+    TOOLS = "herramientas"
+
+
+def make_rows(count):
+    """Filas sintéticas con los tipos que entrega la base de datos"""
+    created = datetime(2024, 1, 1)
+    return [
+        (
+            i, f"SKU-{i:06d}", f"Taladro percutor {i}", "Taladro percutor de 750 W con maletín",
+            "Bosch", f"BSH-{i}", Category.TOOLS, "Taladros",
+            Decimal('89990.00'), Decimal('80991.00'), 10,
+            i % 7 == 0, i % 5 == 0, f"https://cdn.ferremas.cl/productos/{i}.jpg",
+            created + timedelta(minutes=i)
+        ) for i in range(count)
+    ]
+
+
+def stdlib_page(rows):
+    """Serialización anterior: diccionarios con valores convertidos y json.dumps"""
+    products = []
+    for row in rows:
+        item = dict(zip((column.key for column in COLUMNS), row))
+        item['category'] = item['category'].value
+        item['price'] = float(item['price'])
+        item['current_price'] = float(item['current_price'])
+        item['created_at'] = item['created_at'].isoformat()
+        products.append(item)
+    return json.dumps({'products': products}).encode()
+
+
+def orjson_page(rows):
+    """Serialización actual: tuplas a diccionarios y orjson"""
+    return dumps({'products': rows_to_dicts(rows, COLUMNS)})
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rows = make_rows(count)
+
+    # Ambas deben producir el mismo documento
+    assert json.loads(stdlib_page(rows)) == json.loads(orjson_page(rows))
+
+    for name, fn in (('json (stdlib)', stdlib_page), ('orjson', orjson_page)):
+        best = min(timeit.repeat(lambda: fn(rows), number=repeat, repeat=5)) / repeat
+        print(f"{name:>14}: {best * 1000:.2f} ms por página de {count} filas")
+
+
+if __name__ == '__main__':
+    main()
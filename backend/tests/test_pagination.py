@@ -0,0 +1,61 @@
+"""
+Paginación del catálogo: conteo estimado y validación de cursores
+
+Un cursor mal formado o de otro ordenamiento debe responder 400 y no
+fallar en la base de datos.
+"""
+import base64
+import json
+from decimal import Decimal
+
+from app import db  # noqa: F401 (carga la aplicación antes que los modelos)
+from models.product import ProductCategory
+from utils.pagination import encode_cursor
+
+
+def raw_cursor(payload):
+    """Token con un contenido arbitrario, como lo armaría un cliente"""
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def test_estimate_count_with_category_filter(app, catalog):
+    client = app.test_client()
+    category = list(ProductCategory)[0].value
+    response = client.get(f"/api/products?count=estimate&category={category}&per_page=5")
+    assert response.status_code == 200, response.get_data(as_text=True)
+    pagination = response.get_json()['pagination']
+    assert pagination['total_is_estimate'] is True
+    assert isinstance(pagination['total'], int)
+
+
+def test_cursor_continues_with_same_sort(app, catalog):
+    client = app.test_client()
+    cursor = encode_cursor([Decimal('0'), 0], 'price')
+    response = client.get(f"/api/products?sort=price&cursor={cursor}&per_page=1")
+    assert response.status_code == 200
+
+
+def test_cursor_with_wrong_value_type_is_rejected(app, catalog):
+    client = app.test_client()
+    cursor = encode_cursor(["abc", 1], 'price')
+    response = client.get(f"/api/products?sort=price&cursor={cursor}")
+    assert response.status_code == 400
+
+
+def test_cursor_from_another_sort_is_rejected(app, catalog):
+    client = app.test_client()
+    values = [Decimal('1000.00'), catalog['product_id']]
+
+    response = client.get(f"/api/products?sort=newest&cursor={encode_cursor(values, 'price')}")
+    assert response.status_code == 400
+
+    # Aunque se cambie el nombre del ordenamiento, los valores no son fechas
+    response = client.get(f"/api/products?sort=newest&cursor={encode_cursor(values, 'newest')}")
+    assert response.status_code == 400
+
+
+def test_cursor_without_sort_key_is_rejected(app, catalog):
+    client = app.test_client()
+    response = client.get(f"/api/products?sort=price&cursor={raw_cursor([{'d': '10.00'}, 1])}")
+    assert response.status_code == 400
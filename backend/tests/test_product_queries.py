@@ -0,0 +1,80 @@
+"""
+Cantidad de consultas del detalle de producto
+
+El detalle carga producto, stock y sucursales en una consulta; la
+cantidad de sentencias no debe crecer con la cantidad de sucursales.
+"""
+import threading
+import uuid
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, text
+
+from app import db
+from models.product import Branch, Stock
+from services.cache_service import catalog_cache
+
+# Validador del ETag y de la caché (uno por solicitud), producto con
+# stock y sucursales, e historial de precios
+PRODUCT_DETAIL_QUERIES = 3
+
+
+@contextmanager
+def count_queries(app):
+    """Contar las sentencias SQL ejecutadas por el hilo actual"""
+    statements = []
+    thread_id = threading.get_ident()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Otros hilos (p. ej. el índice de sugerencias) no cuentan
+        if threading.get_ident() == thread_id:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def get_product_uncached(app, product_id):
+    """Solicitar el detalle sin aciertos de caché y devolver las sentencias ejecutadas"""
+    client = app.test_client()
+    with app.app_context():
+        if catalog_cache.get_version() is None:
+            pytest.skip("Redis no disponible: el detalle se entrega sin caché ni ETag")
+        catalog_cache.bump_version()
+    with count_queries(app) as statements:
+        response = client.get(f"/api/products/{product_id}")
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'MISS'
+    return statements
+
+
+def test_product_detail_query_count_is_fixed(app, catalog):
+    catalog['set_quantity'](5)
+    statements = get_product_uncached(app, catalog['product_id'])
+    assert len(statements) == PRODUCT_DETAIL_QUERIES, statements
+
+    # Más sucursales con stock no agregan consultas
+    suffix = uuid.uuid4().hex[:8]
+    with app.app_context():
+        branches = [Branch(f"Sucursal extra {suffix} {i}") for i in range(3)]
+        db.session.add_all(branches)
+        db.session.flush()
+        db.session.add_all([Stock(catalog['product_id'], branch.id, 5) for branch in branches])
+        db.session.commit()
+        branch_ids = [branch.id for branch in branches]
+
+    try:
+        statements = get_product_uncached(app, catalog['product_id'])
+        assert len(statements) == PRODUCT_DETAIL_QUERIES, statements
+    finally:
+        with app.app_context():
+            params = {'branch_ids': branch_ids}
+            db.session.execute(text("DELETE FROM stocks WHERE branch_id = ANY(CAST(:branch_ids AS integer[]))"), params)
+            db.session.execute(text("DELETE FROM branches WHERE id = ANY(CAST(:branch_ids AS integer[]))"), params)
+            db.session.commit()
@@ -0,0 +1,102 @@
+"""
+Concurrencia de reservas y entregas sobre un mismo registro de stock
+
+Muchas transacciones en paralelo compiten por las mismas unidades; el
+stock nunca debe quedar sobrevendido (reserved > quantity) ni negativo.
+"""
+import threading
+
+from sqlalchemy import text
+
+from app import db
+from services.stock_service import stock_service, InsufficientStockError
+
+STOCK_QUANTITY = 10
+PARALLEL_REQUESTS = 40
+
+
+def run_parallel(app, order_ids, action):
+    """
+    Ejecutar una acción de stock por pedido, cada una en su hilo y transacción
+
+    Returns:
+        tuple: (pedidos con éxito, pedidos rechazados por stock insuficiente)
+    """
+    barrier = threading.Barrier(len(order_ids))
+    succeeded, rejected, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(order_id):
+        with app.app_context():
+            try:
+                barrier.wait()
+                action(order_id)
+                db.session.commit()
+                with lock:
+                    succeeded.append(order_id)
+            except InsufficientStockError:
+                db.session.rollback()
+                with lock:
+                    rejected.append(order_id)
+            except Exception as e:
+                db.session.rollback()
+                with lock:
+                    errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, args=(order_id,)) for order_id in order_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+    return succeeded, rejected
+
+
+def read_stock(app, stock_id):
+    with app.app_context():
+        row = db.session.execute(
+            text("SELECT quantity, reserved FROM stocks WHERE id = :id"), {'id': stock_id}
+        ).one()
+        db.session.remove()
+    return row
+
+
+def test_parallel_reservations_never_oversell(app, catalog):
+    catalog['set_quantity'](STOCK_QUANTITY)
+    order_ids = catalog['make_orders'](PARALLEL_REQUESTS)
+
+    succeeded, rejected = run_parallel(app, order_ids, lambda order_id: stock_service.reserve(
+        order_id, catalog['branch_id'], {catalog['product_id']: 1}, ttl=None
+    ))
+
+    stock = read_stock(app, catalog['stock_id'])
+    assert len(succeeded) == STOCK_QUANTITY
+    assert len(rejected) == PARALLEL_REQUESTS - STOCK_QUANTITY
+    assert stock.quantity == STOCK_QUANTITY
+    assert stock.reserved == STOCK_QUANTITY
+
+    with app.app_context():
+        reservations = db.session.execute(
+            text("SELECT count(*) FROM stock_reservations WHERE product_id = :product_id"),
+            {'product_id': catalog['product_id']}
+        ).scalar()
+        db.session.remove()
+    assert reservations == len(succeeded)
+
+
+def test_parallel_deliveries_without_reservation_never_go_negative(app, catalog):
+    catalog['set_quantity'](STOCK_QUANTITY)
+    order_ids = catalog['make_orders'](PARALLEL_REQUESTS)
+
+    succeeded, rejected = run_parallel(app, order_ids, lambda order_id: stock_service.consume(
+        order_id, catalog['branch_id'], {catalog['product_id']: 1}
+    ))
+
+    stock = read_stock(app, catalog['stock_id'])
+    assert len(succeeded) == STOCK_QUANTITY
+    assert len(rejected) == PARALLEL_REQUESTS - STOCK_QUANTITY
+    assert stock.quantity == 0
+    assert stock.reserved == 0
@@ -0,0 +1,38 @@
+import hashlib
+from functools import wraps
+from flask import current_app, make_response, request
+
+def conditional_response(validator, private=False):
+    """
+    Decorador que agrega ETag a un endpoint GET y responde 304 si no cambió
+
+    El validador debe ser barato (p. ej. una versión o un MAX(updated_at)):
+    si el cliente ya tiene la representación vigente, el endpoint no se
+    ejecuta y no se construye el cuerpo de la respuesta.
+
+    Args:
+        validator: Función que recibe los argumentos de la ruta y devuelve
+            un valor que cambia cada vez que cambia la respuesta, o None si
+            no puede garantizarlo (la respuesta se entrega sin ETag)
+        private: Si la respuesta depende del usuario autenticado
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = validator(*args, **kwargs)
+            if token is None:
+                return make_response(fn(*args, **kwargs))
+            etag = hashlib.sha1(f"{request.full_path}|{token}".encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+# Claves no textuales (p. ej. ids enteros) se convierten a texto como en json.dumps
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def default(obj):
+    """
+    Tipos que orjson no serializa por sí mismo
+
+    datetime, date, UUID y Enum se serializan de forma nativa (ISO 8601 y
+    el valor del enum); Numeric llega como Decimal y se entrega como número.
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Tipo no serializable a JSON: {type(obj).__name__}")
+
+def dumps(obj):
+    """
+    Serializa a JSON compacto
+
+    Returns:
+        bytes: Documento JSON en UTF-8
+    """
+    return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+
+def rows_to_dicts(rows, columns):
+    """
+    Convierte filas de una consulta por columnas en diccionarios
+
+    Permite serializar listados sin construir objetos del ORM: los valores
+    (Decimal, datetime, Enum) se entregan tal cual al serializador.
+
+    Args:
+        rows: Tuplas de valores en el orden de columns
+        columns: Columnas consultadas (atributos del modelo)
+
+    Returns:
+        list: Un diccionario por fila con la clave de cada columna
+    """
+    keys = [column.key for column in columns]
+    return [dict(zip(keys, row)) for row in rows]
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Proveedor JSON de Flask basado en orjson
+
+    Registrado como app.json, hace que jsonify y request.get_json de todos
+    los blueprints usen el serializador rápido.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
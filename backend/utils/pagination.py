@@ -0,0 +1,220 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app import db
+
+# Modos de conteo del total de resultados
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
+
+def _encode_value(value):
+    """Serializa un valor de clave de orden preservando su tipo"""
+    if isinstance(value, Decimal):
+        return {'d': str(value)}
+    if isinstance(value, datetime):
+        return {'t': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    """Reconstruye un valor de clave de orden serializado por _encode_value"""
+    if isinstance(value, dict):
+        try:
+            if 'd' in value:
+                return Decimal(value['d'])
+            if 't' in value:
+                return datetime.fromisoformat(value['t'])
+        except (InvalidOperation, TypeError, ValueError):
+            pass
+        raise ValueError("Valor de cursor inválido")
+    return value
+
+def _check_value(expr, value):
+    """
+    Verifica que un valor del cursor sea del tipo de su expresión de orden
+
+    Un valor de otro tipo (p. ej. un cursor de otro ordenamiento) fallaría
+    recién en la base de datos.
+
+    Raises:
+        ValueError: Si el tipo no corresponde
+    """
+    if value is None:
+        return
+    try:
+        expected = expr.type.python_type
+    except NotImplementedError:
+        # Expresión sin tipo conocido (p. ej. el ranking de búsqueda): sólo escalares
+        expected = (int, float, str, Decimal, datetime)
+    if expected is float:
+        expected = (int, float)
+    if (isinstance(value, bool) and expected is not bool) or not isinstance(value, expected):
+        raise ValueError("Valor de cursor inválido")
+
+def encode_cursor(values, key=None):
+    """
+    Codifica los valores de la clave de orden en un token opaco
+
+    Args:
+        values: Valores de la clave de orden de la última fila entregada
+        key: Nombre del ordenamiento, para rechazar el cursor en otro distinto
+
+    Returns:
+        str: Token seguro para usar en URLs
+    """
+    payload = [_encode_value(v) for v in values]
+    if key is not None:
+        payload = {'k': key, 'v': payload}
+    payload = json.dumps(payload, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token, key=None):
+    """
+    Decodifica un token generado por encode_cursor
+
+    Args:
+        token: Token recibido del cliente
+        key: Nombre del ordenamiento con que debe haberse generado
+
+    Returns:
+        list: Valores de la clave de orden
+
+    Raises:
+        ValueError: Si el token no es válido o es de otro ordenamiento
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if key is not None:
+        if not isinstance(values, dict) or values.get('k') != key:
+            raise ValueError("Cursor inválido")
+        values = values.get('v')
+    if not isinstance(values, list):
+        raise ValueError("Cursor inválido")
+    return [_decode_value(v) for v in values]
+
+def keyset_filter(sort_keys, values):
+    """
+    Construye la condición "después de" para una clave de orden compuesta
+
+    Args:
+        sort_keys: Lista de tuplas (expresión, descendente)
+        values: Valores de la última fila de la página anterior
+
+    Returns:
+        Condición SQLAlchemy equivalente a (k1, k2, ...) > (v1, v2, ...)
+        respetando la dirección de cada columna
+
+    Raises:
+        ValueError: Si la cantidad o el tipo de los valores no corresponde
+    """
+    if len(values) != len(sort_keys):
+        raise ValueError("Cursor inválido")
+    for (expr, _), value in zip(sort_keys, values):
+        _check_value(expr, value)
+
+    conditions = []
+    for i, (expr, descending) in enumerate(sort_keys):
+        equal_prefix = [sort_keys[j][0] == values[j] for j in range(i)]
+        after = expr < values[i] if descending else expr > values[i]
+        conditions.append(and_(*equal_prefix, after))
+    return or_(*conditions)
+
+def order_by_keys(query, sort_keys):
+    """Aplica la clave de orden compuesta a la consulta"""
+    return query.order_by(*[expr.desc() if descending else expr.asc() for expr, descending in sort_keys])
+
+class Explain(Executable, ClauseElement):
+    """Sentencia EXPLAIN (FORMAT JSON) sobre una consulta, con sus parámetros procesados"""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain, 'postgresql')
+def _compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+def estimate_count(query):
+    """
+    Estima el total de filas de una consulta a partir del planificador
+
+    Evita el COUNT(*) sobre todo el conjunto filtrado; la precisión depende
+    de que las estadísticas de la tabla estén al día (ANALYZE).
+
+    Args:
+        query: Consulta SQLAlchemy sin ORDER BY ni LIMIT
+
+    Returns:
+        int: Número estimado de filas
+    """
+    # Ejecutada como sentencia: los parámetros pasan por el procesamiento
+    # de su tipo (p. ej. Enum) igual que en la consulta original
+    plan = db.session.execute(Explain(query.statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def count_query(query, mode):
+    """
+    Calcula el total de resultados según el modo solicitado
+
+    Args:
+        query: Consulta SQLAlchemy filtrada
+        mode: COUNT_EXACT, COUNT_ESTIMATE o COUNT_NONE
+
+    Returns:
+        int o None
+    """
+    if mode == COUNT_EXACT:
+        return query.order_by(None).count()
+    if mode == COUNT_ESTIMATE:
+        return estimate_count(query.order_by(None))
+    return None
+
+def paginate_keyset(query, sort_keys, cursor, per_page, key=None):
+    """
+    Pagina una consulta por clave de orden (keyset) en lugar de OFFSET
+
+    El costo de cada página es proporcional a su tamaño y no a su
+    profundidad. La última clave de orden debe ser única (p. ej. el id)
+    para que el orden sea total y las páginas no se solapen.
+
+    Args:
+        query: Consulta SQLAlchemy sobre un modelo o sobre columnas
+        sort_keys: Lista de tuplas (expresión, descendente)
+        cursor: Token de la página anterior o None para la primera página
+        per_page: Cantidad de elementos por página
+        key: Nombre del ordenamiento, registrado en el cursor
+
+    Returns:
+        tuple: (elementos, token de la siguiente página o None)
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    if cursor:
+        query = query.filter(keyset_filter(sort_keys, decode_cursor(cursor, key)))
+
+    # Incluir los valores de la clave de orden para construir el cursor
+    width = len(query.column_descriptions)
+    query = order_by_keys(query, sort_keys).add_columns(*[expr for expr, _ in sort_keys])
+    rows = query.limit(per_page + 1).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    # Un modelo se entrega como objeto; una consulta por columnas, como tupla
+    items = [row[0] if width == 1 else tuple(row[:width]) for row in rows]
+    next_cursor = encode_cursor(list(rows[-1][width:]), key) if has_next else None
+    return items, next_cursor
@@ -0,0 +1,118 @@
+import re
+import unicodedata
+from sqlalchemy import func, text
+
+from app import db
+
+# Configuración de búsqueda: español con stemming y sin acentos
+# (creada por la migración db/schemas.py:add_fulltext_search)
+SEARCH_CONFIG = 'es_unaccent'
+
+# Cantidad máxima de términos considerados en una búsqueda
+MAX_SEARCH_TERMS = 8
+
+# Modos de búsqueda aproximada (tolerante a errores de escritura)
+SEARCH_AUTO = 'auto'      # aproximada sólo si no hay coincidencias exactas
+SEARCH_FUZZY = 'true'     # siempre aproximada
+SEARCH_EXACT = 'false'    # sólo texto completo
+
+# Similitud mínima de palabra (pg_trgm) para considerar que un término coincide
+FUZZY_THRESHOLD = 0.5
+
+def normalize_text(value):
+    """Texto en minúsculas y sin acentos"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def tokenize_search(search):
+    """
+    Separa el texto de búsqueda en términos válidos para un tsquery
+
+    Args:
+        search: Texto ingresado por el usuario
+
+    Returns:
+        list: Términos en minúsculas, sin operadores de tsquery
+    """
+    if not search:
+        return []
+    return re.findall(r'\w+', search.lower())[:MAX_SEARCH_TERMS]
+
+def build_tsquery(search):
+    """
+    Construye un tsquery que exige todos los términos, con coincidencia
+    por prefijo para que funcione mientras el usuario escribe
+
+    Args:
+        search: Texto ingresado por el usuario
+
+    Returns:
+        Expresión tsquery o None si no hay términos válidos
+    """
+    terms = tokenize_search(search)
+    if not terms:
+        return None
+    return func.to_tsquery(SEARCH_CONFIG, ' & '.join(f'{term}:*' for term in terms))
+
+def apply_fuzzy_search(query, model, search):
+    """
+    Filtra productos por similitud de trigramas con cada término
+
+    Cada término debe parecerse a alguna palabra del nombre, la marca o
+    la subcategoría (p. ej. "bosh" a "bosch"); el filtro usa el índice
+    GIN de trigramas sobre search_text.
+
+    Args:
+        query: Consulta SQLAlchemy sobre productos
+        model: Modelo Product
+        search: Texto ingresado por el usuario
+
+    Returns:
+        tuple: (consulta filtrada, expresión de similitud o None)
+    """
+    terms = [normalize_text(term) for term in tokenize_search(search)]
+    if not terms:
+        return query, None
+
+    # Umbral del operador %> sólo para la transacción actual
+    db.session.execute(
+        text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+        {'threshold': str(FUZZY_THRESHOLD)}
+    )
+
+    for term in terms:
+        query = query.filter(model.search_text.op('%>')(term))
+
+    similarity = sum(func.word_similarity(term, model.search_text) for term in terms) / len(terms)
+    return query, similarity
+
+def apply_product_search(query, model, search, fuzzy=SEARCH_AUTO):
+    """
+    Filtra una consulta de productos por búsqueda de texto completo o aproximada
+
+    Args:
+        query: Consulta SQLAlchemy sobre productos (con el resto de los filtros)
+        model: Modelo Product
+        search: Texto ingresado por el usuario
+        fuzzy: SEARCH_AUTO, SEARCH_FUZZY o SEARCH_EXACT
+
+    Returns:
+        tuple: (consulta filtrada, expresión de ranking o None)
+    """
+    if fuzzy == SEARCH_FUZZY:
+        return apply_fuzzy_search(query, model, search)
+
+    ts_query = build_tsquery(search)
+    if ts_query is None:
+        return query, None
+
+    matches = query.filter(model.search_vector.op('@@')(ts_query))
+
+    # Sin coincidencias exactas: reintentar tolerando errores de escritura
+    if fuzzy == SEARCH_AUTO and not db.session.query(matches.exists()).scalar():
+        return apply_fuzzy_search(query, model, search)
+
+    rank = func.ts_rank_cd(model.search_vector, ts_query)
+    return matches, rank
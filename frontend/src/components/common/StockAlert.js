@@ -3,6 +3,9 @@ import { Toast, ToastContainer, Badge } from 'react-bootstrap';
 import { useSelector } from 'react-redux';
 import { selectUserRole } from '../../store/auth.slice';
 
+// Productos listados como máximo en una alerta agrupada
+const MAX_LISTED_PRODUCTS = 5;
+
 const StockAlert = () => {
   const [alerts, setAlerts] = useState([]);
   const [showToasts, setShowToasts] = useState({});
@@ -62,6 +65,43 @@ const StockAlert = () => {
   // Si el usuario no debe recibir alertas, no renderizar nada
   if (!shouldReceiveAlerts) return null;
   
+  // Las alertas agrupadas (actualización masiva) traen la lista de productos de la sucursal
+  const isOutOfStock = (data) => (
+    data.products
+      ? data.products.some(product => product.current_stock <= 0)
+      : data.current_stock <= 0
+  );
+  
+  const renderProduct = (product, branchName) => (
+    <>
+      <p className="mb-1"><strong>{product.product_name}</strong></p>
+      <p className="mb-0">
+        {branchName && <>Sucursal: {branchName}<br /></>}
+        Stock actual: {product.current_stock} unidades<br />
+        {product.min_stock && `Stock mínimo: ${product.min_stock} unidades`}
+      </p>
+    </>
+  );
+  
+  const renderProductList = (data) => (
+    <>
+      <p className="mb-1"><strong>{data.message}</strong></p>
+      <ul className="mb-0 ps-3">
+        {data.products.slice(0, MAX_LISTED_PRODUCTS).map(product => (
+          <li key={product.product_id}>
+            {product.product_name}: {product.current_stock} unidades
+            {product.min_stock !== undefined && ` (mínimo ${product.min_stock})`}
+          </li>
+        ))}
+      </ul>
+      {data.products.length > MAX_LISTED_PRODUCTS && (
+        <small className="text-muted">
+          y {data.products.length - MAX_LISTED_PRODUCTS} productos más
+        </small>
+      )}
+    </>
+  );
+  
   // Renderizar contenedor de toasts
   return (
     <ToastContainer className="p-3" position="bottom-end">
@@ -75,23 +115,22 @@ const StockAlert = () => {
         >
           <Toast.Header closeButton={true}>
             <Badge 
-              bg={alert.data.current_stock <= 0 ? 'danger' : 'warning'} 
+              bg={isOutOfStock(alert.data) ? 'danger' : 'warning'} 
               className="me-2"
             >
-              {alert.data.current_stock <= 0 ? 'Agotado' : 'Stock bajo'}
+              {isOutOfStock(alert.data) ? 'Agotado' : 'Stock bajo'}
             </Badge>
-            <strong className="me-auto">Alerta de stock</strong>
+            <strong className="me-auto">
+              {alert.data.products ? `Alerta de stock · ${alert.data.branch_name}` : 'Alerta de stock'}
+            </strong>
             <small className="text-muted">
               {new Date(alert.timestamp).toLocaleTimeString()}
             </small>
           </Toast.Header>
           <Toast.Body>
-            <p className="mb-1"><strong>{alert.data.product_name}</strong></p>
-            <p className="mb-0">
-              Sucursal: {alert.data.branch_name}<br />
-              Stock actual: {alert.data.current_stock} unidades<br />
-              {alert.data.min_stock && `Stock mínimo: ${alert.data.min_stock} unidades`}
-            </p>
+            {alert.data.products
+              ? renderProductList(alert.data)
+              : renderProduct(alert.data, alert.data.branch_name)}
           </Toast.Body>
         </Toast>
       ))}